@@ -0,0 +1,134 @@
+# admission.py
+import math
+import time
+import heapq
+import itertools
+import threading
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED_TOTAL, ADMISSION_WAIT_SECONDS
+
+PRIORITY_TEXT = 0
+PRIORITY_MEDIA = 1
+
+
+class Rejected(Exception):
+    """
+    Raised when a request can't be admitted; carries the HTTP status and a Retry-After hint.
+    """
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def check_deadline(deadline, stage):
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+
+
+class _Slot:
+    def __init__(self, gate):
+        self._gate = gate
+        self._held_since = time.time()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._gate._release(time.time() - self._held_since)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded priority queue in front of it. Lower priority values
+    are admitted first, FIFO within a priority. A full queue is rejected immediately (429);
+    a request whose deadline passes while it waits is dropped from the queue (503).
+    """
+
+    def __init__(self, name, limit, max_queue):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self._active = 0
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._avg_hold = 1.0  # EWMA of slot hold time, for Retry-After
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        with self._cond:
+            return max(1, math.ceil(self._avg_hold * (len(self._waiting) + 1) / self.limit))
+
+    def _reject(self, status, reason, message):
+        ADMISSION_REJECTED_TOTAL.inc(gate=self.name, reason=reason)
+        return Rejected(status, message, self.retry_after())
+
+    def _grant(self, t0):
+        self._active += 1
+        ADMISSION_ACTIVE.set(self._active, gate=self.name)
+        ADMISSION_WAIT_SECONDS.observe(time.time() - t0, gate=self.name)
+        return _Slot(self)
+
+    def admit(self, priority=PRIORITY_TEXT, deadline=None):
+        """
+        Block until a slot is free and return it (use as a context manager or call release()).
+        Raises Rejected when the queue is full or `deadline` passes first.
+        """
+        t0 = time.time()
+        with self._cond:
+            if self._active < self.limit and not self._waiting:
+                return self._grant(t0)
+            if len(self._waiting) >= self.max_queue:
+                raise self._reject(429, "queue_full", f"Too many pending {self.name} requests")
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            ADMISSION_QUEUE_DEPTH.set(len(self._waiting), gate=self.name)
+            try:
+                while not (self._waiting[0] == ticket and self._active < self.limit):
+                    timeout = None if deadline is None else deadline - time.time()
+                    if timeout is not None and timeout <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        raise self._reject(503, "deadline", f"Timed out waiting for a {self.name} slot")
+                    self._cond.wait(timeout)
+                heapq.heappop(self._waiting)
+                return self._grant(t0)
+            finally:
+                ADMISSION_QUEUE_DEPTH.set(len(self._waiting), gate=self.name)
+                # the head of the queue may have changed; let the next waiter re-check
+                self._cond.notify_all()
+
+    def occupy(self):
+        """
+        Take a slot at once, even past the limit. For work that outlives the request it was
+        admitted for and can't be interrupted, so new requests wait until it really ends.
+        """
+        with self._cond:
+            self._active += 1
+            ADMISSION_ACTIVE.set(self._active, gate=self.name)
+            return _Slot(self)
+
+    def _release(self, held):
+        with self._cond:
+            self._active -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            ADMISSION_ACTIVE.set(self._active, gate=self.name)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"active": self._active, "limit": self.limit, "queued": len(self._waiting),
+                    "max_queue": self.max_queue}
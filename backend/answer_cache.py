@@ -0,0 +1,132 @@
+# answer_cache.py
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))  # cosine; > 1 disables the semantic tier
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    return _SPACE_RE.sub(" ", text.strip().lower()).rstrip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Bounded, TTL'd cache of answers. Lookups try the normalized question first, then the
+    most similar cached question of the same scope by embedding cosine similarity.
+    Every entry remembers the index version (chunk counts) of its domains and is
+    dropped once that changes, so answers never outlive the documents behind them.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._entries = OrderedDict()  # (scope, normalized question) -> entry
+        self._lock = threading.Lock()
+
+    def _valid(self, entry, version, now):
+        return entry["version"] == version and now - entry["created"] <= self.ttl
+
+    def lookup(self, scope, question, version, vector=None):
+        """
+        Returns (payload, kind, similarity) with kind "exact" or "semantic", or None on a miss.
+        """
+        key = (scope, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._valid(entry, version, now):
+                    self._entries.move_to_end(key)
+                    self.hits["exact"] += 1
+                    return entry["payload"], "exact", 1.0
+                del self._entries[key]
+
+            if vector is not None and self.threshold <= 1.0:
+                keys, vecs = [], []
+                for k, e in list(self._entries.items()):
+                    if k[0] != scope or e["vector"] is None:
+                        continue
+                    if not self._valid(e, version, now):
+                        del self._entries[k]
+                        continue
+                    keys.append(k)
+                    vecs.append(e["vector"])
+                if vecs:
+                    q = np.asarray(vector, dtype=np.float32)
+                    q /= max(float(np.linalg.norm(q)), 1e-12)
+                    sims = np.stack(vecs) @ q
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        self._entries.move_to_end(keys[best])
+                        self.hits["semantic"] += 1
+                        return self._entries[keys[best]]["payload"], "semantic", float(sims[best])
+            self.misses += 1
+        return None
+
+    def store(self, scope, domains, question, version, payload, vector=None):
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._entries[key] = {
+                "payload": payload, "domains": tuple(domains), "version": version,
+                "vector": vector, "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(self.max_entries, 1):
+                self._entries.popitem(last=False)
+
+    def invalidate_domain(self, domain):
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if domain in e["domains"]]
+            for k in stale:
+                del self._entries[k]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": dict(self.hits), "misses": self.misses}
+
+
+_cache = AnswerCache()
+
+
+def lookup_answer(scope, question, version, vector=None):
+    return _cache.lookup(scope, question, version, vector) if ANSWER_CACHE else None
+
+
+def store_answer(scope, domains, question, version, payload, vector=None):
+    if ANSWER_CACHE:
+        _cache.store(scope, domains, question, version, payload, vector)
+
+
+def invalidate_domain(domain):
+    """
+    Drop cached answers that drew on `domain`; called whenever its chunks change.
+    """
+    return _cache.invalidate_domain(domain)
+
+
+def clear_answer_cache():
+    _cache.clear()
+
+
+def answer_cache_stats():
+    return _cache.stats() if ANSWER_CACHE else None
@@ -1,125 +1,518 @@
+import io
 import os
+import json
 import time
+import hmac
+import uuid
+import queue
+import sys
 import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
-from embed import embed
+from ingest_jobs import IngestQueue, INGEST_QUEUE_DEPTH
 import query as query_module
-from memory_store import save_memory, create_memory, clear_memory_file
-from media_processing import extract_text_from_file
-from get_vector_db import get_vector_db  # ✅ for DB check
+from memory_store import clear_long_term_memory, clear_memory_file, clear_sessions, forget_session as forget_session_store, start_session_compactor, DEFAULT_SESSION
+from warmup import Readiness, start_background
+from metrics import REQUEST_SECONDS, REQUESTS_TOTAL, STAGE_SECONDS, observe_stages, render_latest
+from get_vector_db import embedding_stats, get_vector_db, warm_up  # ✅ for DB check
+from retrieval import STRATEGIES
+from answer_cache import answer_cache_stats
+from admission import AdmissionGate, DeadlineExceeded, Rejected, PRIORITY_MEDIA, PRIORITY_TEXT
 
 load_dotenv()
 
 TEMP_FOLDER = os.getenv('TEMP_FOLDER', './_temp')
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './uploads')
 RESET_DB = os.getenv('RESET_DB_ON_STARTUP', 'false').lower() == 'true'
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '4'))
+MEDIA_PER_REQUEST = int(os.getenv('MEDIA_PER_REQUEST', '2'))
+MEDIA_FILE_TIMEOUT = float(os.getenv('MEDIA_FILE_TIMEOUT', '300'))
+MEDIA_MAX_FILE_BYTES = int(os.getenv('MEDIA_MAX_FILE_BYTES', str(200 * 1024 * 1024)))
+MEDIA_INMEMORY_BYTES = int(os.getenv('MEDIA_INMEMORY_BYTES', str(8 * 1024 * 1024)))
+WARMUP_MODE = os.getenv('WARMUP_MODE', 'background').lower()  # background | blocking
+GEN_CONCURRENCY = int(os.getenv('GEN_CONCURRENCY', '4'))  # queries retrieving/generating at once
+GEN_QUEUE_DEPTH = int(os.getenv('GEN_QUEUE_DEPTH', '32'))
+MEDIA_CONCURRENCY = int(os.getenv('MEDIA_CONCURRENCY', '2'))  # queries extracting attachments at once
+MEDIA_QUEUE_DEPTH = int(os.getenv('MEDIA_QUEUE_DEPTH', '8'))
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '570'))  # seconds; the frontend gives up at 600
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # enables global memory wipes via X-Admin-Token; empty = disabled
 
-os.makedirs(TEMP_FOLDER, exist_ok=True)
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+def _media():
+    # OpenCV, Tesseract, Whisper and moviepy are only imported once media is needed
+    import media_processing
+    return media_processing
 
-# ✅ Optional DB reset
-if RESET_DB:
-    shutil.rmtree('./chroma', ignore_errors=True)
-    print("[INFO] Vector DB reset on startup.")
 
-# ✅ Check and seed Chroma DB before loading the model
-try:
-    db = get_vector_db("general")
-    if not db.get()["ids"]:  # DB empty
-        print("[*] Chroma DB empty — running seed_data.py from local PDFs...")
-        os.system("python seed_data.py")  # Will read local PDFs, no internet needed
+def _collection_count(db):
+    try:
+        return db._collection.count()
+    except Exception:
+        return len(db.get(include=[])["ids"])
+
+
+def _prepare_vector_db():
+    # ✅ Check and seed Chroma DB (embedder load happens here too)
+    warm_up(["general"])
+    count = _collection_count(get_vector_db("general"))
+    if count == 0:  # DB empty
+        print("[*] Chroma DB empty — seeding from local PDFs...")
+        from seed_data import seed_local_pdfs
+        seed_local_pdfs()  # Will read local PDFs, no internet needed
     else:
-        print(f"[*] Chroma DB already has {len(db.get()['ids'])} documents.")
-except Exception as e:
-    print(f"[!] Could not check/seed DB: {e}")
+        print(f"[*] Chroma DB already has {count} documents.")
+
+
+readiness = Readiness()
+readiness.register("whisper", required=False)
+WARMUP_STEPS = [
+    [("vector_db", _prepare_vector_db)],
+    [("llm", query_module._ensure_llm)],
+    [("whisper", lambda: _media()._ensure_whisper())],
+]
 
 app = Flask(__name__)
 CORS(app)
+media_pool = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+# Admission control: text-only queries go ahead of media queries for generation slots,
+# and media extraction has its own, smaller limit so video bursts can't starve text questions
+generation_gate = AdmissionGate("generation", GEN_CONCURRENCY, GEN_QUEUE_DEPTH)
+media_gate = AdmissionGate("media", MEDIA_CONCURRENCY, MEDIA_QUEUE_DEPTH)
+
+ingest_queue = None
+_initialized = False
+
+def init_app():
+    """
+    Start-up side effects: folders, the optional DB reset, model warm-up, the session
+    compactor and the ingestion queue. They are kept out of import time because spawned
+    PDF parser processes re-import the main script (as __mp_main__) and must start nothing.
+    """
+    global ingest_queue, _initialized
+    if _initialized:
+        return app
+    _initialized = True
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    # ✅ Optional DB reset
+    if RESET_DB:
+        shutil.rmtree('./chroma', ignore_errors=True)
+        print("[INFO] Vector DB reset on startup.")
+
+    if WARMUP_MODE == "blocking":
+        # ===== Preload everything before Flask binds =====
+        print("🔄 Loading model into memory... please wait...")
+        for chain in WARMUP_STEPS:
+            for name, fn in chain:
+                readiness.run(name, fn)
+        print("✅ Model loaded and ready to accept queries!")
+    else:
+        start_background(readiness, WARMUP_STEPS)
+    start_session_compactor()
+    ingest_queue = IngestQueue()
+    return app
+
+def _not_ready(*components):
+    pending = [c for c in components if not readiness.is_ready(c)]
+    if not pending:
+        return None
+    return jsonify({"error": f"Service warming up: {', '.join(pending)} not ready"}), 503, {"Retry-After": "10"}
+
+def _rejected(e):
+    return jsonify({"error": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
+
+def _request_deadline():
+    """
+    Absolute deadline for the current request: REQUEST_DEADLINE, or less if the client
+    sends X-Request-Timeout (seconds).
+    """
+    timeout = REQUEST_DEADLINE
+    try:
+        timeout = min(timeout, float(request.headers.get('X-Request-Timeout', timeout)))
+    except ValueError:
+        pass
+    return g.get("request_start", time.time()) + timeout
 
-# ===== Preload the model at startup =====
-print("🔄 Loading model into memory... please wait...")
-query_module._ensure_pipeline()
-print("✅ Model loaded and ready to accept queries!")
+@app.before_request
+def _start_timer():
+    g.request_start = time.time()
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(time.time() - g.get("request_start", time.time()), endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def route_metrics():
+    return Response(render_latest(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok", "model_loaded": query_module._hf_pipe is not None}), 200
+    ready = readiness.is_ready()
+    return jsonify({
+        "status": "ok",
+        "ready": ready,
+        "model_loaded": readiness.is_ready("llm"),
+        "generation_backend": query_module._backend_info,
+        "prefix_cache": query_module._prefix_cache.stats() if query_module._prefix_cache else None,
+        "embedding": embedding_stats(),
+        "answer_cache": answer_cache_stats(),
+        "admission": {"generation": generation_gate.stats(), "media": media_gate.stats()},
+        # media_processing is imported on the first upload; don't load OpenCV/Whisper for a health check
+        "media_cache": _media().get_media_cache_stats() if "media_processing" in sys.modules else None,
+        "components": readiness.report(),
+    }), 200
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    ready = readiness.is_ready()
+    return jsonify({"ready": ready, "components": readiness.report()}), 200 if ready else 503
 
 @app.route('/embed', methods=['POST'])
 def route_embed():
+    """
+    Save the upload to disk and queue it for background ingestion.
+    Returns 202 with a job id; poll /jobs/<job_id> for progress.
+    """
     domain = request.form.get('domain', 'general')
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if embed(file, domain=domain):
-        return jsonify({"message": f"File embedded successfully into '{domain}' domain"}), 200
-    return jsonify({"error": "File embedding failed"}), 400
+    if ingest_queue.depth() >= INGEST_QUEUE_DEPTH:
+        return jsonify({"error": "Ingestion queue is full, try again later"}), 503, {"Retry-After": "30"}
 
-@app.route('/query', methods=['POST'])
-def route_query():
-    start_time = time.time()
+    filename = secure_filename(file.filename)
+    path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+    file.save(path)  # streamed to disk in chunks by werkzeug
+    try:
+        job = ingest_queue.submit(path, domain, filename)
+    except queue.Full:
+        os.remove(path)
+        return jsonify({"error": "Ingestion queue is full, try again later"}), 503, {"Retry-After": "30"}
+    return jsonify({
+        "message": f"File queued for embedding into '{domain}' domain",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def route_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job.to_dict()), 200
+
+def _spool_upload(f):
+    """
+    Read an upload into memory, or into a temp file once it outgrows MEDIA_INMEMORY_BYTES
+    (and always for video, which OpenCV can only open from disk).
+    Returns (data, path) with exactly one of them set. Raises ValueError past MEDIA_MAX_FILE_BYTES.
+    """
+    buf = io.BytesIO()
+    out = None
+    path = None
+    total = 0
+    to_disk = _media().needs_file_path(f.filename)
+    try:
+        while True:
+            block = f.stream.read(1 << 20)
+            if not block:
+                break
+            total += len(block)
+            if total > MEDIA_MAX_FILE_BYTES:
+                raise ValueError(f"{f.filename} exceeds {MEDIA_MAX_FILE_BYTES} bytes")
+            if out is None and (to_disk or total > MEDIA_INMEMORY_BYTES):
+                path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{secure_filename(f.filename)}")
+                out = open(path, "wb")
+                out.write(buf.getvalue())
+                buf = None
+            (out or buf).write(block)
+    except Exception:
+        if out is not None:
+            out.close()
+            os.remove(path)
+        raise
+    if out is not None:
+        out.close()
+        return None, path
+    return buf.getvalue(), None
+
+
+def _extract_upload(filename, data, path):
+    t0 = time.time()
+    try:
+        if path is None:
+            return _media().extract_text_from_bytes(data, filename)
+        return _media().extract_text_from_file(path)
+    finally:
+        STAGE_SECONDS.observe(time.time() - t0, stage=f"media_{_media().media_kind(filename) or 'other'}")
+        if path is not None:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+def _extract_uploads(files, timings, deadline=None):
+    """
+    Extract text from all attachments in parallel on the shared media pool, at most
+    MEDIA_PER_REQUEST at a time for one request, each bounded by MEDIA_FILE_TIMEOUT
+    and the request deadline.
+    Results keep the upload order; upload_save / media_extraction time goes into `timings`.
+    """
+    t0 = time.time()
+    uploads = []
+    results = []
+    for f in files:
+        if not f or not f.filename:
+            continue
+        try:
+            data, path = _spool_upload(f)
+        except ValueError as e:
+            results.append(f"[media skipped: {e}]")
+            continue
+        results.append(None)
+        uploads.append((len(results) - 1, f.filename, data, path))
+    timings["upload_save"] = time.time() - t0
+
+    t0 = time.time()
+    waiting = list(uploads)
+    running = {}  # future -> (slot, filename, spooled path or None, file deadline)
+    while waiting or running:
+        while waiting and len(running) < MEDIA_PER_REQUEST:
+            slot, filename, data, path = waiting.pop(0)
+            fut = media_pool.submit(_extract_upload, filename, data, path)
+            file_deadline = time.time() + MEDIA_FILE_TIMEOUT
+            running[fut] = (slot, filename, path,
+                            file_deadline if deadline is None else min(file_deadline, deadline))
+        timeout = max(0.0, min(entry[3] for entry in running.values()) - time.time())
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.time()
+        for fut, (slot, filename, path, file_deadline) in list(running.items()):
+            if fut in done:
+                try:
+                    results[slot] = fut.result()
+                except Exception as e:
+                    results[slot] = f"[media extraction failed: {e}]"
+            elif now >= file_deadline:
+                if fut.cancel():
+                    # never started, so _extract_upload won't delete the spooled file
+                    if path is not None:
+                        try:
+                            os.remove(path)
+                        except Exception:
+                            pass
+                else:
+                    # already running and can't be interrupted: it keeps its media_pool thread,
+                    # so it keeps counting against the media gate until it actually finishes
+                    held = media_gate.occupy()
+                    fut.add_done_callback(lambda _, held=held: held.release())
+                results[slot] = f"[media extraction timed out: {filename}]"
+            else:
+                continue
+            running.pop(fut)
+    timings["media_extraction"] = time.time() - t0
+    return results
+
+
+def _parse_query_request(timings, deadline=None):
+    """
+    Read query text, domain, session id, retrieval strategy and any extracted media context
+    from the current request. Upload and media stage timings are added to `timings`.
+    Media extraction waits for a media_gate slot; raises Rejected if none frees up in time.
+    """
     query_text = None
     domain = 'general'
+    session_id = DEFAULT_SESSION
+    strategy = None
     extracted_context = []
 
     if request.content_type and 'application/json' in request.content_type:
         data = request.get_json(silent=True) or {}
         query_text = data.get('query', '')
         domain = data.get('domain', 'general')
+        session_id = data.get('session_id') or DEFAULT_SESSION
+        strategy = data.get('retrieval') or None
     else:
         query_text = request.form.get('query', '')
         domain = request.form.get('domain', 'general')
+        session_id = request.form.get('session_id') or DEFAULT_SESSION
+        strategy = request.form.get('retrieval') or None
         files = request.files.getlist('files') or ([] if 'file' not in request.files else [request.files['file']])
-        for f in files:
-            if not f or not f.filename:
-                continue
-            path = os.path.join(UPLOAD_FOLDER, secure_filename(f.filename))
-            f.save(path)
-            text = extract_text_from_file(path)
-            if text:
-                extracted_context.append(text)
-            try:
-                os.remove(path)
-            except Exception:
-                pass
-
-    if not query_text and not extracted_context:
-        return jsonify({"error": "No query or extractable media provided"}), 400
+        if any(f and f.filename for f in files):
+            t0 = time.time()
+            with media_gate.admit(PRIORITY_MEDIA, deadline):
+                timings["media_queue"] = time.time() - t0
+                extracted_context = [text for text in _extract_uploads(files, timings, deadline) if text]
+        observe_stages(timings)
 
     merged = query_text
     if extracted_context:
         merged += "\n\n[MEDIA CONTEXT]\n" + "\n---\n".join(extracted_context)
+    return query_text, domain, session_id, strategy, merged
+
+
+def _wants_timings():
+    flag = request.args.get('timings') or request.form.get('timings') or (request.get_json(silent=True) or {}).get('timings')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+@app.route('/query', methods=['POST'])
+def route_query():
+    start_time = time.time()
+    not_ready = _not_ready("vector_db", "llm")
+    if not_ready:
+        return not_ready
+    request_timings = {}
+    deadline = _request_deadline()
+    try:
+        query_text, domain, session_id, strategy, merged = _parse_query_request(request_timings, deadline)
+    except Rejected as e:
+        return _rejected(e)
+
+    if not merged:
+        return jsonify({"error": "No query or extractable media provided"}), 400
+
+    if strategy and strategy not in STRATEGIES:
+        return jsonify({"error": f"Unknown retrieval strategy '{strategy}'"}), 400
 
-    response, retrieved_docs = query_module.query(merged, domain=domain, return_docs=True)
+    stats = {}
+    has_media = merged != query_text
+    try:
+        t0 = time.time()
+        with generation_gate.admit(PRIORITY_MEDIA if has_media else PRIORITY_TEXT, deadline):
+            request_timings["generation_queue"] = time.time() - t0
+            # answers grounded in attached media are never served from (or stored in) the answer cache
+            response, retrieved_docs = query_module.query(merged, domain=domain, return_docs=True,
+                                                          session_id=session_id, strategy=strategy, stats=stats,
+                                                          use_cache=not has_media, deadline=deadline)
+    except Rejected as e:
+        return _rejected(e)
+    except (DeadlineExceeded, TimeoutError) as e:
+        return jsonify({"error": str(e)}), 504
 
     latency = time.time() - start_time
     print(f"[API METRICS] Query: {query_text[:50]}... | Domain: {domain} | Latency: {latency:.2f}s")
 
     if response:
-        return jsonify({
+        body = {
             "answer": response,
             "latency": latency,
-            "retrieved_docs": retrieved_docs
-        }), 200
+            "retrieved_docs": retrieved_docs,
+            "retrieval": stats.get("retrieval"),
+            "cache": stats.get("cache"),
+        }
+        if _wants_timings():
+            body["timings"] = dict(request_timings, **stats.get("timings", {}))
+            body["tokens"] = stats.get("tokens")
+            body["compression"] = stats.get("compression")
+            body["generation"] = stats.get("generation")
+        return jsonify(body), 200
     return jsonify({"error": "Something went wrong"}), 400
 
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/query/stream', methods=['POST'])
+def route_query_stream():
+    """
+    Server-sent events version of /query: `token` events carry generated text,
+    a final `done` event carries retrieved doc count, latency and per-stage timings.
+    """
+    start_time = time.time()
+    not_ready = _not_ready("vector_db", "llm")
+    if not_ready:
+        return not_ready
+    request_timings = {}
+    deadline = _request_deadline()
+    try:
+        query_text, domain, session_id, strategy, merged = _parse_query_request(request_timings, deadline)
+    except Rejected as e:
+        return _rejected(e)
+
+    if not merged:
+        return jsonify({"error": "No query or extractable media provided"}), 400
+
+    if strategy and strategy not in STRATEGIES:
+        return jsonify({"error": f"Unknown retrieval strategy '{strategy}'"}), 400
+
+    has_media = merged != query_text
+    t0 = time.time()
+    try:
+        # the slot is held for the whole stream and released when it ends or the client disconnects
+        slot = generation_gate.admit(PRIORITY_MEDIA if has_media else PRIORITY_TEXT, deadline)
+    except Rejected as e:
+        return _rejected(e)
+    request_timings["generation_queue"] = time.time() - t0
+
+    def generate():
+        events = query_module.query_stream(merged, domain=domain, session_id=session_id, strategy=strategy,
+                                           use_cache=not has_media, deadline=deadline)
+        try:
+            for event, payload in events:
+                if event == "token":
+                    yield _sse("token", {"text": payload})
+                else:
+                    latency = time.time() - start_time
+                    payload["latency"] = latency
+                    payload["timings"] = dict(request_timings, **payload.get("timings", {}))
+                    print(f"[API METRICS] Stream query: {query_text[:50]}... | Domain: {domain} | Latency: {latency:.2f}s")
+                    yield _sse("done", payload)
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+        finally:
+            events.close()  # stops generation if the client went away mid-stream
+            slot.release()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    response.call_on_close(slot.release)
+    return response
+
+def _request_session_id():
+    data = request.get_json(silent=True) or {}
+    return data.get('session_id') or request.form.get('session_id') or DEFAULT_SESSION
+
+def _is_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
 @app.route('/clear_memory', methods=['POST'])
 def clear_memory():
-    query_module.memory = create_memory()
-    save_memory(query_module.memory)
-    clear_memory_file()
-    return jsonify({"message": "Memory cleared"}), 200
+    """
+    Clear the caller's session memory. {"all": true} wipes every session and the
+    long-term memory, and requires the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('all'):
+        if not _is_admin():
+            return jsonify({"error": "Clearing all memory requires admin credentials"}), 403
+        clear_sessions()
+        clear_memory_file()
+        clear_long_term_memory()
+        return jsonify({"message": "All memory cleared"}), 200
+    session_id = _request_session_id()
+    forget_session_store(session_id)
+    return jsonify({"message": f"Memory of session '{session_id}' cleared"}), 200
 
 @app.route('/forget_session', methods=['POST'])
 def forget_session():
-    query_module.memory = create_memory()
-    return jsonify({"message": "Current session forgotten"}), 200
+    session_id = _request_session_id()
+    forget_session_store(session_id)
+    return jsonify({"message": f"Session '{session_id}' forgotten"}), 200
 
 if __name__ == '__main__':
+    init_app()
     app.run(host="0.0.0.0", port=8080, debug=False, use_reloader=False)
@@ -0,0 +1,123 @@
+# batching.py
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, List, Optional
+from langchain_core.language_models.llms import LLM
+
+GEN_MAX_BATCH_SIZE = int(os.getenv("GEN_MAX_BATCH_SIZE", "4"))
+GEN_BATCH_WAIT_MS = float(os.getenv("GEN_BATCH_WAIT_MS", "20"))
+
+
+class MicroBatcher:
+    """
+    Collects items from concurrent callers and processes them together. A batch is
+    flushed when it reaches `max_batch_size` or when `max_wait_ms` has passed since
+    its first item arrived. Subclasses implement `_process(items) -> results`.
+    """
+
+    name = "micro-batcher"
+
+    def __init__(self, max_batch_size, max_wait_ms):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._start()
+        if hasattr(os, "register_at_fork"):
+            # threads don't survive fork(); pre-forked server workers need their own
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, items):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            # callers that gave up (see GenerationScheduler.generate) cancelled their futures
+            batch = [(item, fut) for item, fut in self._collect() if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self._process([item for item, _ in batch])
+                for (_, fut), result in zip(batch, results):
+                    fut.set_result(result)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+class GenerationScheduler(MicroBatcher):
+    """
+    Runs prompts from concurrent callers through a transformers pipeline as padded batches.
+    """
+
+    name = "generation-scheduler"
+
+    def __init__(self, hf_pipeline, max_batch_size=GEN_MAX_BATCH_SIZE, max_wait_ms=GEN_BATCH_WAIT_MS):
+        self.pipeline = hf_pipeline
+        super().__init__(max_batch_size, max_wait_ms)
+
+    def generate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """
+        Generate text for one prompt. With a `deadline` (epoch seconds) a prompt still
+        queued at that time is withdrawn and TimeoutError is raised.
+        """
+        fut = self.submit(prompt)
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            fut.cancel()
+            raise TimeoutError("Generation deadline exceeded")
+
+    def _process(self, prompts):
+        outputs = self.pipeline(prompts, batch_size=len(prompts))
+        results = []
+        for out in outputs:
+            # pipelines return a list of candidates per prompt
+            if isinstance(out, list):
+                out = out[0]
+            results.append(out["generated_text"])
+        return results
+
+
+class BatchedLLM(LLM):
+    """
+    LangChain LLM that routes every call through a shared GenerationScheduler,
+    so the answer chain and MultiQueryRetriever rephrasings of concurrent
+    requests end up in the same forward pass.
+    """
+
+    scheduler: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "batched_huggingface_pipeline"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        # bind(deadline=...) on this LLM bounds how long the call may wait for its batch
+        return self.scheduler.generate(prompt, deadline=kwargs.get("deadline"))
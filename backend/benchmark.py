@@ -0,0 +1,335 @@
+# benchmark.py
+"""
+Offline performance benchmark for the query, ingestion and media paths.
+
+    python benchmark.py --out bench.json                  # run and write results
+    python benchmark.py --out bench.json --save-baseline  # also store as the new baseline
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.15
+
+Everything runs against a throwaway vector DB / memory store in a temp dir, with the
+tiny default model (HF_MODEL) loaded from the local Hugging Face cache only.
+"""
+import os
+import sys
+import json
+import math
+import time
+import wave
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+WORDS = (
+    "machine learning model data training neural network regression classification "
+    "finance law health education contract patient portfolio tuition risk evidence "
+    "gradient feature label dataset accuracy inference vector retrieval embedding"
+).split()
+
+QUESTIONS = [
+    "What is machine learning?",
+    "Give examples of ML applications",
+    "How is risk measured in a portfolio?",
+    "What evidence is needed for a contract dispute?",
+    "How are neural networks trained?",
+]
+
+
+def _configure_offline_env(workdir):
+    """
+    Point every store at `workdir` and forbid network access. Must run before the backend
+    modules are imported because they read their settings at import time.
+    """
+    os.environ.setdefault("HF_MODEL", "sshleifer/tiny-gpt2")
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "chroma")
+    os.environ["LOCAL_INDEX_PATH"] = os.path.join(workdir, "local_index")
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+    os.environ["LONG_TERM_PATH"] = os.path.join(workdir, "memory_store.jsonl")
+    os.environ["INGEST_JOBS_DB"] = os.path.join(workdir, "ingest_jobs.db")
+    os.environ["MEDIA_CACHE_DIR"] = os.path.join(workdir, "media_cache")
+    os.environ["MEDIA_CACHE_MAX_BYTES"] = "0"  # measure real extraction, not cache hits
+    os.environ["ANSWER_CACHE"] = "false"  # measure retrieval and generation, not cached answers
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    os.environ["TEMP_FOLDER"] = os.path.join(workdir, "tmp")
+    os.environ["WARMUP_MODE"] = "blocking"
+    os.environ.setdefault("RETRIEVAL_STRATEGY", "dense")
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _latency_summary(latencies, wall):
+    return {
+        "requests": len(latencies),
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "throughput_rps": len(latencies) / wall if wall > 0 else None,
+    }
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ===== Fixtures =====
+
+def make_pdf_corpus(folder, n_files, pages, seed=0):
+    from fpdf import FPDF
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(n_files):
+        pdf = FPDF()
+        pdf.set_font("Helvetica", size=11)
+        for _ in range(pages):
+            pdf.add_page()
+            text = " ".join(rng.choice(WORDS) for _ in range(350))
+            pdf.multi_cell(0, 6, text)
+        path = os.path.join(folder, f"doc_{i:03d}.pdf")
+        pdf.output(path)
+        paths.append(path)
+    return paths
+
+
+def make_image(path, text="TurboAsk benchmark 12345"):
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (800, 200), "white")
+    ImageDraw.Draw(img).text((20, 80), text, fill="black")
+    img.save(path)
+    return path
+
+
+def make_audio(path, seconds=5, rate=16000):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(seconds * rate):
+            sample = int(8000 * math.sin(2 * math.pi * 440 * i / rate))
+            frames += sample.to_bytes(2, "little", signed=True)
+        w.writeframes(bytes(frames))
+    return path
+
+
+def make_video(path, seconds=10, fps=10):
+    import cv2
+    import numpy as np
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (640, 360))
+    for i in range(seconds * fps):
+        frame = np.full((360, 640, 3), 255, dtype=np.uint8)
+        cv2.putText(frame, f"Slide {i // (fps * 3)}", (40, 180), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+# ===== Benchmarks =====
+
+def bench_ingestion(pdf_paths, domain="bench"):
+    import embed
+    t0 = time.time()
+    results = embed.embed_many(pdf_paths, domain=domain)
+    wall = time.time() - t0
+    chunks = sum(len(ids) for ids in results.values())
+    return {"files": len(pdf_paths), "chunks": chunks, "seconds": wall,
+            "chunks_per_sec": chunks / wall if wall > 0 else None}
+
+
+def bench_media(fixtures, repeats):
+    import media_processing
+    out = {}
+    for kind, path in fixtures.items():
+        times = []
+        for _ in range(repeats):
+            t0 = time.time()
+            media_processing.extract_text_from_file(path)
+            times.append(time.time() - t0)
+        out[kind] = {"runs": repeats, "p50": _percentile(times, 50), "max": max(times)}
+    return out
+
+
+def bench_query(client, domain, concurrency_levels, requests_per_level):
+    out = {}
+    for level in concurrency_levels:
+        latencies = []
+        lock = threading.Lock()
+
+        def one(i):
+            t0 = time.time()
+            resp = client.post("/query", json={
+                "query": QUESTIONS[i % len(QUESTIONS)],
+                "domain": domain,
+                "session_id": f"bench-{level}-{i % level}",
+            })
+            elapsed = time.time() - t0
+            if resp.status_code == 200:
+                with lock:
+                    latencies.append(elapsed)
+
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(one, range(requests_per_level)))
+        wall = time.time() - t0
+        out[str(level)] = _latency_summary(latencies, wall)
+        out[str(level)]["errors"] = requests_per_level - len(latencies)
+    return out
+
+
+# ===== Baseline comparison =====
+
+# metric path -> True when higher is better
+COMPARED_METRICS = {
+    ("ingestion", "chunks_per_sec"): True,
+    ("startup_seconds",): False,
+    ("peak_rss_mb",): False,
+}
+
+
+def _lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def _compared_paths(results):
+    paths = dict(COMPARED_METRICS)
+    for level in (results.get("query") or {}):
+        paths[("query", level, "p50")] = False
+        paths[("query", level, "p95")] = False
+        paths[("query", level, "throughput_rps")] = True
+    for kind in (results.get("media") or {}):
+        paths[("media", kind, "p50")] = False
+    return paths
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of {metric, baseline, current, change, regression} for metrics present in both.
+    """
+    rows = []
+    for path, higher_is_better in _compared_paths(results).items():
+        cur, base = _lookup(results, path), _lookup(baseline, path)
+        if not isinstance(cur, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+            continue
+        change = (cur - base) / base
+        worse = -change if higher_is_better else change
+        rows.append({
+            "metric": ".".join(path),
+            "baseline": base,
+            "current": cur,
+            "change": change,
+            "regression": worse > tolerance,
+        })
+    return rows
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="turboask-bench-")
+    _configure_offline_env(workdir)
+    random.seed(args.seed)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "model": os.environ["HF_MODEL"],
+            "args": vars(args),
+        }
+    }
+
+    pdf_paths = make_pdf_corpus(os.path.join(workdir, "corpus"), args.pdfs, args.pages, seed=args.seed)
+    results["ingestion"] = bench_ingestion(pdf_paths)
+    print(f"[bench] ingestion: {results['ingestion']}")
+
+    t0 = time.time()
+    import app as app_module
+    app_module.init_app()
+    results["startup_seconds"] = time.time() - t0
+    print(f"[bench] app import + warm-up: {results['startup_seconds']:.2f}s")
+
+    client = app_module.app.test_client()
+    levels = [int(x) for x in args.concurrency.split(",") if x]
+    results["query"] = bench_query(client, "bench", levels, args.requests)
+    print(f"[bench] query: {json.dumps(results['query'], indent=2)}")
+
+    if not args.skip_media:
+        fixtures = {}
+        media_dir = os.path.join(workdir, "media")
+        os.makedirs(media_dir, exist_ok=True)
+        for kind, maker, name in (("image", make_image, "sample.png"),
+                                  ("audio", make_audio, "sample.wav"),
+                                  ("video", make_video, "sample.mp4")):
+            try:
+                fixtures[kind] = maker(os.path.join(media_dir, name))
+            except Exception as e:
+                print(f"[bench] skipping {kind} fixture: {e}")
+        results["media"] = bench_media(fixtures, args.media_repeats)
+        print(f"[bench] media: {results['media']}")
+
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline TurboAsk benchmark")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--pdfs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--concurrency", default="1,2,4")
+    parser.add_argument("--requests", type=int, default=20, help="requests per concurrency level")
+    parser.add_argument("--media-repeats", type=int, default=3)
+    parser.add_argument("--skip-media", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        for row in results["comparison"]:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"[bench] {row['metric']}: {row['baseline']:.4g} -> {row['current']:.4g} "
+                  f"({row['change']:+.1%}) {flag}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"[bench] results written to {args.out}")
+
+    if args.save_baseline:
+        baseline_copy = {k: v for k, v in results.items() if k != "comparison"}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline_copy, f, indent=2)
+        print(f"[bench] baseline saved to {args.baseline}")
+
+    if any(row["regression"] for row in results.get("comparison", [])):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
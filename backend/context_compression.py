@@ -0,0 +1,126 @@
+# context_compression.py
+import os
+import re
+import numpy as np
+
+COMPRESS_CONTEXT = os.getenv("COMPRESS_CONTEXT", "true").lower() == "true"
+COMPRESS_TARGET_TOKENS = int(os.getenv("COMPRESS_TARGET_TOKENS", "0"))  # optional context cap; 0 = the prompt budget's room
+COMPRESS_MIN_CHARS = 12  # fragments shorter than this (page numbers, bullets) are dropped
+_MAX_OVERLAP_CHARS = 400  # well above embed.CHUNK_OVERLAP; bounds the overlap search
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _norm(text):
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.split(text or "") if s and len(s.strip()) >= COMPRESS_MIN_CHARS]
+
+
+def _overlap(tail_of, head_of):
+    """
+    Length of the longest suffix of `tail_of` that is also a prefix of `head_of`
+    (0 if shorter than COMPRESS_MIN_CHARS).
+    """
+    longest = min(len(tail_of), len(head_of), _MAX_OVERLAP_CHARS)
+    for size in range(longest, COMPRESS_MIN_CHARS - 1, -1):
+        if tail_of.endswith(head_of[:size]):
+            return size
+    return 0
+
+
+def strip_overlaps(chunks):
+    """
+    Cut the CHUNK_OVERLAP text neighbouring chunks share: a chunk's head repeating an earlier
+    chunk's tail, or its tail repeating an earlier chunk's head (neighbours retrieved in
+    reverse order). The overlap is character-level and usually crosses sentence boundaries,
+    so sentence deduplication alone would miss it. Returns (chunks, characters removed).
+    """
+    out = []
+    removed = 0
+    for chunk in chunks:
+        chunk = chunk or ""
+        head = max((_overlap(prev, chunk) for prev in out), default=0)
+        chunk = chunk[head:]
+        tail = max((_overlap(chunk, prev) for prev in out), default=0)
+        chunk = chunk[:len(chunk) - tail]
+        removed += head + tail
+        out.append(chunk)
+    return out, removed
+
+
+def dedupe_sentences(chunks):
+    """
+    Split chunks into (chunk index, sentence) pairs, dropping repeated sentences (the same
+    chunk returned by several queries or domains) and fragments already contained in an
+    earlier sentence (the CHUNK_OVERLAP text at the start of a neighbouring chunk).
+    Returns (pairs, number of duplicates dropped).
+    """
+    pairs = []
+    seen = set()
+    kept_text = ""
+    dropped = 0
+    for idx, chunk in enumerate(chunks):
+        for sentence in split_sentences(chunk):
+            key = _norm(sentence)
+            if key in seen or key in kept_text:
+                dropped += 1
+                continue
+            seen.add(key)
+            kept_text += key + "\n"
+            pairs.append((idx, sentence))
+    return pairs, dropped
+
+
+def _assemble(pairs, keep):
+    grouped = {}
+    for i in sorted(keep):
+        idx, sentence = pairs[i]
+        grouped.setdefault(idx, []).append(sentence)
+    return [" ".join(grouped[idx]) for idx in sorted(grouped)]
+
+
+def compress_chunks(question, chunks, embeddings, count, max_tokens, sep_cost=0):
+    """
+    Shrink retrieved chunks to at most `max_tokens`. Overlaps between neighbouring chunks are
+    cut and sentences deduplicated; if they still don't fit, each sentence is scored by cosine
+    similarity to the question in one matrix product, and the best-scoring sentences are kept
+    (in their original order) until the budget is full.
+    `count` is the prompt tokenizer's counter and `sep_cost` the token cost of the chunk separator.
+    Returns (chunks, info).
+    """
+    tokens_before = sum(count(c) for c in chunks)
+    chunks, overlap_chars = strip_overlaps(chunks)
+    pairs, duplicates = dedupe_sentences(chunks)
+    info = {
+        "sentences": len(pairs) + duplicates,
+        "duplicates": duplicates,
+        "overlap_chars": overlap_chars,
+        "tokens_before": tokens_before,
+    }
+    costs = [count(sentence) + 1 for _, sentence in pairs]
+    groups = len({idx for idx, _ in pairs})
+    if sum(costs) + sep_cost * max(groups - 1, 0) <= max_tokens:
+        kept = _assemble(pairs, range(len(pairs)))
+        info.update(kept=len(pairs), scored=False, tokens_after=sum(costs))
+        return kept, info
+
+    vectors = np.asarray(embeddings.embed_documents([sentence for _, sentence in pairs]), dtype=np.float32)
+    q = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    scores = vectors @ (q / max(float(np.linalg.norm(q)), 1e-12))
+
+    keep, used, open_groups = [], 0, set()
+    for i in np.argsort(-scores):
+        idx = pairs[i][0]
+        cost = costs[i] + (sep_cost if open_groups and idx not in open_groups else 0)
+        if used + cost > max_tokens:
+            continue  # a shorter, lower-scored sentence may still fit
+        keep.append(int(i))
+        open_groups.add(idx)
+        used += cost
+    info.update(kept=len(keep), scored=True, tokens_after=used)
+    return _assemble(pairs, keep), info
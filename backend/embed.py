@@ -1,12 +1,146 @@
 # embed.py
 import os
+import sqlite3
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from get_vector_db import get_vector_db
+from get_vector_db import get_vector_db, CHROMA_PATH
+from retrieval import add_to_lexical_index, drop_lexical_index
+from answer_cache import invalidate_domain
 
 # Chunk size safe for flan-t5-base (~400 characters)
 CHUNK_SIZE = 400
 CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Lives next to the vector DB so resetting ./chroma also resets the references
+CHUNK_REFS_PATH = os.path.join(CHROMA_PATH, "chunk_refs.db")
+
+
+def load_pdf(file_path):
+    loader = PyPDFLoader(file_path)
+    return loader.load()
+
+
+def split_documents(documents):
+    # Split into small chunks
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    return splitter.split_documents(documents)
+
+
+def load_and_split(file_path):
+    """
+    Parse a PDF and split it into chunks. Top-level so it can run in a worker process.
+    """
+    return split_documents(load_pdf(file_path))
+
+
+def chunk_id(chunk):
+    """
+    Content-addressed id: identical chunk text always maps to the same vector DB id.
+    """
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+def _chunk_refs_db():
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    conn = sqlite3.connect(CHUNK_REFS_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunk_refs ("
+        "domain TEXT NOT NULL, chunk_id TEXT NOT NULL, owner TEXT NOT NULL, "
+        "PRIMARY KEY (domain, chunk_id, owner))"
+    )
+    return conn
+
+
+def add_chunk_refs(domain, owner, ids):
+    """
+    Record that `owner` (e.g. an uploaded file) uses these chunks. Chunks are shared by
+    content, so a referenced chunk must survive the removal of a seed PDF with the same text.
+    """
+    conn = _chunk_refs_db()
+    try:
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO chunk_refs (domain, chunk_id, owner) VALUES (?, ?, ?)",
+                             [(domain, cid, owner) for cid in set(ids)])
+    finally:
+        conn.close()
+
+
+def referenced_chunks(domain, ids):
+    """
+    The subset of `ids` that some owner recorded with add_chunk_refs() still uses.
+    """
+    ids = list(ids)
+    found = set()
+    if not ids or not os.path.exists(CHUNK_REFS_PATH):
+        return found
+    conn = _chunk_refs_db()
+    try:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ",".join("?" * len(batch))
+            found.update(r[0] for r in conn.execute(
+                f"SELECT DISTINCT chunk_id FROM chunk_refs WHERE domain = ? AND chunk_id IN ({marks})",
+                [domain] + batch,
+            ))
+    finally:
+        conn.close()
+    return found
+
+
+def add_chunks(chunks, domain="general", progress=None, owner=None):
+    """
+    Write chunks to the domain collection, skipping any whose content is already stored.
+    progress(embedded, to_embed) is called after every batch, if given.
+    With `owner`, the chunk ids are also recorded as used by it (see add_chunk_refs).
+    Returns (ids of all chunks, number of chunks actually embedded).
+    """
+    ids = [chunk_id(c) for c in chunks]
+    unique = {}
+    for cid, chunk in zip(ids, chunks):
+        unique.setdefault(cid, chunk)
+
+    db = get_vector_db(domain)
+    new_ids, new_chunks = [], []
+    candidate_ids = list(unique)
+    for start in range(0, len(candidate_ids), EMBED_BATCH_SIZE):
+        batch = candidate_ids[start:start + EMBED_BATCH_SIZE]
+        existing = set(db.get(ids=batch, include=[])["ids"])
+        for cid in batch:
+            if cid not in existing:
+                new_ids.append(cid)
+                new_chunks.append(unique[cid])
+
+    for start in range(0, len(new_chunks), EMBED_BATCH_SIZE):
+        db.add_documents(new_chunks[start:start + EMBED_BATCH_SIZE], ids=new_ids[start:start + EMBED_BATCH_SIZE])
+        if progress:
+            progress(min(start + EMBED_BATCH_SIZE, len(new_chunks)), len(new_chunks))
+    add_to_lexical_index(domain, new_chunks)
+    if new_chunks:
+        invalidate_domain(domain)
+    if owner:
+        add_chunk_refs(domain, owner, ids)
+    return ids, len(new_chunks)
+
+
+def delete_chunks(ids, domain="general"):
+    """
+    Remove chunks by id from the domain collection.
+    """
+    if not ids:
+        return
+    db = get_vector_db(domain)
+    for start in range(0, len(ids), EMBED_BATCH_SIZE):
+        db.delete(ids=ids[start:start + EMBED_BATCH_SIZE])
+    drop_lexical_index(domain)
+    invalidate_domain(domain)
+
 
 def embed(file_path, domain="general"):
     """
@@ -19,25 +153,51 @@ def embed(file_path, domain="general"):
             print(f"[!] File not found: {file_path}")
             return False
 
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-
-        # Split into small chunks
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP
-        )
-        chunks = splitter.split_documents(documents)
+        chunks = load_and_split(file_path)
 
         if not chunks:
             print(f"[!] No text extracted from {file_path}")
             return False
 
-        db = get_vector_db(domain)
-        db.add_documents(chunks)
-        print(f"[+] Embedded {len(chunks)} chunks from {os.path.basename(file_path)}")
+        _, added = add_chunks(chunks, domain, owner=f"file:{os.path.abspath(file_path)}")
+        print(f"[+] Embedded {added} new of {len(chunks)} chunks from {os.path.basename(file_path)}")
         return True
 
     except Exception as e:
         print(f"[!] Failed to embed {os.path.basename(file_path)}: {e}")
         return False
+
+
+def embed_many(file_paths, domain="general", workers=INGEST_WORKERS):
+    """
+    Bulk version of embed(): PDFs are parsed and split on a process pool, then their
+    chunks are embedded in large batches as each file finishes.
+    Returns {file_path: chunk ids} for the files that produced chunks.
+    """
+    results = {}
+    if not file_paths:
+        return results
+    # spawn, not fork: a forked child inherits torch/OpenMP thread state and the loaded
+    # models, and can deadlock or copy them; the parser workers need neither
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(file_paths))),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {path: pool.submit(load_and_split, path) for path in file_paths}
+        for path, fut in futures.items():
+            name = os.path.basename(path)
+            try:
+                chunks = fut.result()
+            except Exception as e:
+                print(f"[!] Failed to parse {name}: {e}")
+                continue
+            if not chunks:
+                print(f"[!] No text extracted from {name}")
+                results[path] = []
+                continue
+            try:
+                ids, added = add_chunks(chunks, domain)
+            except Exception as e:
+                print(f"[!] Failed to embed {name}: {e}")
+                continue
+            results[path] = ids
+            print(f"[+] Embedded {added} new of {len(chunks)} chunks from {name}")
+    return results
@@ -0,0 +1,197 @@
+# embedding_service.py
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from batching import MicroBatcher
+
+# torch : sentence-transformers in fp32
+# int8  : torch dynamic int8 quantization of the encoder's nn.Linear layers
+# onnx  : sentence-transformers ONNX Runtime backend (EMBED_ONNX_FILE picks e.g. a quantized export)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "")
+EMBED_ENCODE_BATCH = int(os.getenv("EMBED_ENCODE_BATCH", "64"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # empty = in-memory cache only
+EMBED_DISK_CACHE_SIZE = int(os.getenv("EMBED_DISK_CACHE_SIZE", "1000000"))  # rows kept in the disk tier
+EMBED_DISK_PRUNE_EVERY = int(os.getenv("EMBED_DISK_PRUNE_EVERY", "1000"))  # disk writes between prunes
+
+
+def _load_encoder(model_name, backend):
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        kwargs = {"file_name": EMBED_ONNX_FILE} if EMBED_ONNX_FILE else {}
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs=kwargs)
+    model = SentenceTransformer(model_name, device="cpu" if backend == "int8" else None)
+    if backend == "int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class _VectorCache:
+    """
+    Bounded text-hash -> vector LRU in memory, optionally backed by SQLite on disk.
+    The disk tier is an LRU too: rows carry a last-used time, and every
+    EMBED_DISK_PRUNE_EVERY writes the least recently used rows beyond max_disk_entries
+    are deleted.
+    """
+
+    def __init__(self, max_entries=EMBED_CACHE_SIZE, path=EMBED_CACHE_PATH, max_disk_entries=EMBED_DISK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._mem = OrderedDict()
+        self._path = path
+        self.reopen()
+
+    def reopen(self):
+        """
+        (Re)open the disk tier; SQLite connections must not be shared across fork().
+        """
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        if self._path:
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vec BLOB NOT NULL, "
+                               "last_used REAL NOT NULL DEFAULT 0)")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(vectors)")}
+            if "last_used" not in columns:
+                # caches written before the disk tier was bounded: treat every row as least recently used
+                self._conn.execute("ALTER TABLE vectors ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_last_used ON vectors(last_used)")
+            self._conn.commit()
+            self._prune()
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        with self._lock:
+            for k in keys:
+                vec = self._mem.get(k)
+                if vec is not None:
+                    self._mem.move_to_end(k)
+                    found[k] = vec
+                else:
+                    missing.append(k)
+            if missing and self._conn is not None:
+                now = time.time()
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    marks = ",".join("?" * len(batch))
+                    hit = []
+                    for k, blob in self._conn.execute(f"SELECT key, vec FROM vectors WHERE key IN ({marks})", batch):
+                        found[k] = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(k, found[k])
+                        hit.append(k)
+                    if hit:
+                        self._conn.execute(f"UPDATE vectors SET last_used = ? WHERE key IN ({','.join('?' * len(hit))})",
+                                           [now] + hit)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def _remember(self, key, vec):
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def put_many(self, pairs):
+        with self._lock:
+            for k, vec in pairs:
+                self._remember(k, vec)
+            if self._conn is not None and pairs:
+                now = time.time()
+                self._conn.executemany("INSERT OR REPLACE INTO vectors (key, vec, last_used) VALUES (?, ?, ?)",
+                                       [(k, vec.astype(np.float32).tobytes(), now) for k, vec in pairs])
+                self._conn.commit()
+                self._writes += len(pairs)
+                if self._writes >= EMBED_DISK_PRUNE_EVERY:
+                    self._prune()
+
+    def _prune(self):
+        # caller holds self._lock (or owns the cache exclusively, as in reopen)
+        self._writes = 0
+        self._conn.execute(
+            "DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max(0, self.max_disk_entries),),
+        )
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._mem), "hits": self.hits, "misses": self.misses,
+                    "disk": self._conn is not None}
+
+
+class _QueryBatcher(MicroBatcher):
+    name = "embedding-batcher"
+
+    def __init__(self, encode):
+        self._encode = encode
+        super().__init__(EMBED_MAX_BATCH, EMBED_BATCH_WAIT_MS)
+
+    def _process(self, texts):
+        return list(self._encode(texts))
+
+
+class EmbeddingService(Embeddings):
+    """
+    LangChain Embeddings used by every Chroma handle. Single texts from concurrent
+    requests are micro-batched into one encode call, large lists (ingestion) are encoded
+    directly in EMBED_ENCODE_BATCH chunks, and every vector is cached by text hash.
+    Outputs match HuggingFaceEmbeddings (un-normalized float vectors).
+    """
+
+    def __init__(self, model_name, backend=EMBED_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.model = _load_encoder(model_name, backend)
+        self.cache = _VectorCache()
+        self._batcher = _QueryBatcher(self._encode)
+
+    def _encode(self, texts):
+        vecs = self.model.encode(list(texts), batch_size=EMBED_ENCODE_BATCH,
+                                 convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vecs, dtype=np.float32)
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}|{self.backend}|{text}".encode("utf-8")).hexdigest()
+
+    def _embed(self, texts):
+        keys = [self._key(t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing = OrderedDict()
+        for k, t in zip(keys, texts):
+            if k not in found:
+                missing.setdefault(k, t)
+        if missing:
+            miss_texts = list(missing.values())
+            if len(miss_texts) <= EMBED_MAX_BATCH:
+                futures = [self._batcher.submit(t) for t in miss_texts]
+                vecs = [f.result() for f in futures]
+            else:
+                vecs = list(self._encode(miss_texts))
+            fresh = list(zip(missing.keys(), vecs))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k].tolist() for k in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts)
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+    def stats(self):
+        return dict(self.cache.stats(), backend=self.backend, model=self.model_name)
@@ -1,8 +1,18 @@
 # evaluation.py
-from get_vector_db import get_vector_db
-from query import query
-from ragas import evaluate
-from ragas.metrics import faithfulness, answer_relevancy, context_recall
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from get_vector_db import get_vector_db, _ensure_embedding, EMBEDDING_MODEL
+
+EVAL_CACHE_PATH = os.getenv("EVAL_CACHE_PATH", "eval_cache.db")
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "256"))
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "2"))
 
 # Example evaluation dataset
 EVAL_DATA = [
@@ -16,39 +26,232 @@ EVAL_DATA = [
     }
 ]
 
-def evaluate_retrieval(domain="general"):
+
+def load_dataset(path):
+    """
+    Load a JSONL dataset: one {"query", "ground_truth", optional "id", "relevant_ids", "relevant_sources"} per line.
+    """
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                items.append(json.loads(line))
+    return items
+
+
+class EvalCache:
+    """
+    SQLite key/value store for retrieval results and answers, so re-runs only recompute
+    items whose content, index version or model changed.
+    """
+
+    def __init__(self, path=EVAL_CACHE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                for k, v in self._conn.execute(f"SELECT key, value FROM cache WHERE key IN ({marks})", batch):
+                    found[k] = json.loads(v)
+        return found
+
+    def put_many(self, pairs):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                                   [(k, json.dumps(v)) for k, v in pairs])
+            self._conn.commit()
+
+
+def index_version(db):
+    """
+    Cheap fingerprint of a collection's contents; changes whenever chunks are added or removed.
+    """
+    try:
+        count = db._collection.count()
+    except Exception:
+        count = len(db.get(include=[])["ids"])
+    return f"{db._collection.name}:{count}:{EMBEDDING_MODEL}"
+
+
+def _item_key(item):
+    return item.get("id") or hashlib.sha256(item["query"].encode("utf-8")).hexdigest()
+
+
+def batch_retrieve(db, queries, k, batch_size=EVAL_BATCH_SIZE):
+    """
+    Embed queries in batches and search the collection with one call per batch.
+    Returns a list of {"ids", "documents", "metadatas"} per query.
+    """
+    embedding = _ensure_embedding()
+    out = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        vectors = embedding.embed_documents(batch)
+        res = db._collection.query(query_embeddings=vectors, n_results=k,
+                                   include=["documents", "metadatas"])
+        for i in range(len(batch)):
+            out.append({
+                "ids": res["ids"][i],
+                "documents": res["documents"][i],
+                "metadatas": res["metadatas"][i],
+            })
+    return out
+
+
+def relevance_matrix(items, retrieved, k):
+    """
+    Boolean (n_items, k) matrix of relevant hits plus the number of relevant docs per item.
+    Relevance comes from "relevant_ids", then "relevant_sources", else a ground-truth substring match.
+    """
+    rel = np.zeros((len(items), k), dtype=bool)
+    n_relevant = np.ones(len(items), dtype=np.float32)
+    for i, (item, res) in enumerate(zip(items, retrieved)):
+        if item.get("relevant_ids"):
+            wanted = set(item["relevant_ids"])
+            hits = [cid in wanted for cid in res["ids"]]
+            n_relevant[i] = len(wanted)
+        elif item.get("relevant_sources"):
+            wanted = set(item["relevant_sources"])
+            hits = [(meta or {}).get("source") in wanted for meta in res["metadatas"]]
+            n_relevant[i] = len(wanted)
+        else:
+            gt = (item.get("ground_truth") or "").lower()
+            hits = [bool(gt) and gt in (doc or "").lower() for doc in res["documents"]]
+        rel[i, :len(hits)] = hits[:k]
+    return rel, n_relevant
+
+
+def retrieval_metrics(rel, n_relevant):
+    """
+    Vectorized recall@k, hit rate, MRR and nDCG@k over a relevance matrix.
+    """
+    n, k = rel.shape
+    if n == 0:
+        return {}
+    hits = rel.sum(axis=1)
+    recall = np.minimum(hits / n_relevant, 1.0)
+    first = np.where(rel.any(axis=1), rel.argmax(axis=1) + 1, 0)
+    rr = np.where(first > 0, 1.0 / np.maximum(first, 1), 0.0)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (rel * discounts).sum(axis=1)
+    ideal = np.array([discounts[:int(min(r, k))].sum() for r in n_relevant])
+    ndcg = np.where(ideal > 0, dcg / np.maximum(ideal, 1e-12), 0.0)
+    return {
+        f"recall@{k}": float(recall.mean()),
+        f"hit_rate@{k}": float((hits > 0).mean()),
+        "mrr": float(rr.mean()),
+        f"ndcg@{k}": float(ndcg.mean()),
+        "items": int(n),
+    }
+
+
+def generate_answers(items, domain, version, cache, workers=EVAL_WORKERS, strategy=None):
+    """
+    Answer every item on a worker pool without touching conversation memory.
+    Answers are cached by (item, index version, model, strategy).
+    """
+    from query import query, HF_MODEL
+    keys = [EvalCache.key("answer", _item_key(it), it["query"], version, HF_MODEL, strategy) for it in items]
+    cached = cache.get_many(keys)
+    todo = [(i, it) for i, (it, key) in enumerate(zip(items, keys)) if key not in cached]
+    print(f"[*] Generating {len(todo)} answers ({len(items) - len(todo)} cached) with {workers} workers...")
+
+    def one(pair):
+        i, it = pair
+        return i, query(it["query"], domain=domain, strategy=strategy, use_memory=False, use_cache=False)
+
+    fresh = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for i, answer in pool.map(one, todo):
+            cached[keys[i]] = answer
+            fresh.append((keys[i], answer))
+            if len(fresh) >= 50:
+                cache.put_many(fresh)
+                fresh = []
+    cache.put_many(fresh)
+    return [cached[key] for key in keys]
+
+
+def evaluate_retrieval(domain="general", dataset=None, k=3, generate=True, workers=EVAL_WORKERS,
+                       strategy=None, use_ragas=True):
+    items = dataset if dataset is not None else EVAL_DATA
     db = get_vector_db(domain)
-    results = []
-    total_correct = 0
-    total_docs = 0
+    cache = EvalCache()
+    version = index_version(db)
 
-    for item in EVAL_DATA:
-        retrieved_docs = db.similarity_search(item["query"], k=3)
-        retrieved_texts = [doc.page_content for doc in retrieved_docs]
+    # Retrieval (no generation), cached per item + index version
+    t0 = time.time()
+    keys = [EvalCache.key("retrieval", _item_key(it), it["query"], version, k) for it in items]
+    cached = cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        fresh = batch_retrieve(db, [items[i]["query"] for i in missing], k)
+        cache.put_many([(keys[i], res) for i, res in zip(missing, fresh)])
+        for i, res in zip(missing, fresh):
+            cached[keys[i]] = res
+    retrieved = [cached[key] for key in keys]
+    print(f"[*] Retrieval for {len(items)} items ({len(missing)} computed) in {time.time() - t0:.2f}s")
 
-        # Basic precision/recall check
-        if any(gt.lower() in doc.lower() for doc in retrieved_texts for gt in [item["ground_truth"]]):
-            total_correct += 1
-        total_docs += 1
+    metrics = retrieval_metrics(*relevance_matrix(items, retrieved, k))
+    print(f"Retrieval metrics: {json.dumps(metrics, indent=2)}")
 
-        results.append({
-            "question": item["query"],
-            "answer": query(item["query"], domain=domain),
-            "contexts": retrieved_texts,
-            "ground_truth": item["ground_truth"]
-        })
+    if not generate:
+        return metrics
 
-    print(f"Basic Retrieval Accuracy: {total_correct}/{total_docs} = {total_correct/total_docs:.2%}")
+    answers = generate_answers(items, domain, version, cache, workers=workers, strategy=strategy)
+    results = [
+        {
+            "question": it["query"],
+            "answer": answer,
+            "contexts": [doc for doc in res["documents"] if doc],
+            "ground_truth": it.get("ground_truth", ""),
+        }
+        for it, res, answer in zip(items, retrieved, answers)
+    ]
 
     # RAGAS evaluation
-    try:
-        eval_result = evaluate(
-            dataset=results,
-            metrics=[faithfulness, answer_relevancy, context_recall]
-        )
-        print("RAGAS Results:\n", eval_result)
-    except Exception as e:
-        print("⚠ RAGAS evaluation failed or not installed:", e)
+    if use_ragas:
+        try:
+            # ragas pulls in a large dependency tree; only import it when evaluating
+            from ragas import evaluate
+            from ragas.metrics import faithfulness, answer_relevancy, context_recall
+            eval_result = evaluate(
+                dataset=results,
+                metrics=[faithfulness, answer_relevancy, context_recall]
+            )
+            print("RAGAS Results:\n", eval_result)
+        except Exception as e:
+            print("⚠ RAGAS evaluation failed or not installed:", e)
+    return metrics
+
 
 if __name__ == "__main__":
-    evaluate_retrieval()
+    parser = argparse.ArgumentParser(description="Evaluate retrieval (and optionally answers) on a dataset")
+    parser.add_argument("--dataset", help="JSONL file; defaults to the built-in EVAL_DATA")
+    parser.add_argument("--domain", default="general")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    parser.add_argument("--retrieval", default=None, help="strategy for generation: dense / hybrid / multi_query")
+    parser.add_argument("--no-generation", action="store_true", help="only compute retrieval metrics")
+    parser.add_argument("--no-ragas", action="store_true")
+    args = parser.parse_args()
+
+    evaluate_retrieval(
+        domain=args.domain,
+        dataset=load_dataset(args.dataset) if args.dataset else None,
+        k=args.k,
+        generate=not args.no_generation,
+        workers=args.workers,
+        strategy=args.retrieval,
+        use_ragas=not args.no_ragas,
+    )
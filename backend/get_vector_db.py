@@ -1,21 +1,105 @@
 import os
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import threading
+from collections import OrderedDict
 from langchain_community.vectorstores import Chroma
+from embedding_service import EmbeddingService
+from local_index import LocalVectorStore, LOCAL_INDEX_PATH
 
 CHROMA_PATH = os.getenv('CHROMA_PATH', './chroma')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'local-rag')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+MAX_OPEN_COLLECTIONS = int(os.getenv('MAX_OPEN_COLLECTIONS', '8'))
+# chroma : LangChain Chroma persisted under CHROMA_PATH
+# local  : memory-mapped float16 index under LOCAL_INDEX_PATH (see local_index.py)
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma').lower()
+
+# Process-wide registry: one embedding service, one store handle per collection (LRU)
+_EMBEDDING = None
+_DBS = OrderedDict()
+_LOCK = threading.RLock()
+
+
+def _ensure_embedding():
+    global _EMBEDDING
+    if _EMBEDDING is None:
+        with _LOCK:
+            if _EMBEDDING is None:
+                _EMBEDDING = EmbeddingService(EMBEDDING_MODEL)
+                print(f"[INFO] Embedding model loaded: {EMBEDDING_MODEL}")
+    return _EMBEDDING
+
+
+def _after_fork():
+    # Forked server workers keep the embedding model (copy-on-write) but open their own
+    # store handles and cache connection: SQLite and Chroma clients are not fork-safe.
+    global _LOCK
+    _LOCK = threading.RLock()
+    _DBS.clear()
+    if _EMBEDDING is not None:
+        _EMBEDDING.cache.reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def embedding_stats():
+    return _EMBEDDING.stats() if _EMBEDDING is not None else None
+
+
+def _collection_name(domain=None):
+    return f"{COLLECTION_NAME}-{domain}" if domain else COLLECTION_NAME
+
 
 def get_vector_db(domain=None):
     """
-    Get a Chroma vector database instance.
+    Get a vector database instance (Chroma, or LocalVectorStore with VECTOR_BACKEND=local).
     If domain is specified, use a domain-specific collection.
+    Handles are cached per collection and share a single embedding model;
+    the least recently used handle is dropped once MAX_OPEN_COLLECTIONS is exceeded.
+    """
+    collection = _collection_name(domain)
+    with _LOCK:
+        db = _DBS.get(collection)
+        if db is not None:
+            _DBS.move_to_end(collection)
+            return db
+
+        if VECTOR_BACKEND == "local":
+            db = LocalVectorStore(collection, _ensure_embedding(), root=LOCAL_INDEX_PATH)
+        else:
+            db = Chroma(
+                collection_name=collection,
+                persist_directory=CHROMA_PATH,
+                embedding_function=_ensure_embedding(),
+            )
+        _DBS[collection] = db
+        while len(_DBS) > max(MAX_OPEN_COLLECTIONS, 1):
+            evicted, _ = _DBS.popitem(last=False)
+            print(f"[INFO] Closed vector DB handle: {evicted}")
+        return db
+
+
+def warm_up(domains=("general",)):
+    """
+    Load the embedding model and open the given domain collections ahead of the first request.
+    """
+    _ensure_embedding()
+    for domain in domains or []:
+        get_vector_db(domain)
+
+
+def close_vector_db(domain=None):
+    """
+    Drop the cached handle for a domain (e.g. after its collection was deleted on disk).
+    """
+    with _LOCK:
+        _DBS.pop(_collection_name(domain), None)
+
+
+def clear_registry():
+    """
+    Drop every cached collection handle. The embedding model stays loaded.
     """
-    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    collection = f"{COLLECTION_NAME}-{domain}" if domain else COLLECTION_NAME
-    db = Chroma(
-        collection_name=collection,
-        persist_directory=CHROMA_PATH,
-        embedding_function=embedding,
-    )
-    return db
+    with _LOCK:
+        _DBS.clear()
@@ -0,0 +1,271 @@
+# ingest_jobs.py
+import os
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+from collections import defaultdict
+from embed import load_pdf, split_documents, add_chunks
+
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "16"))
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+INGEST_JOBS_DB = os.getenv("INGEST_JOBS_DB", "ingest_jobs.db")  # job status, shared by all server workers
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process there; without fork() one server owns the DB
+        return pid == os.getpid()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # e.g. EPERM: exists, owned by someone else
+        pass
+    return True
+
+
+class IngestJob:
+    # persisted columns, in table order
+    FIELDS = ("id", "status", "domain", "filename", "error", "pages_parsed", "chunks_total",
+              "chunks_to_embed", "chunks_embedded", "created", "started", "finished", "path", "owner_pid")
+
+    def __init__(self, path, domain, filename):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.domain = domain
+        self.filename = filename
+        self.status = "queued"
+        self.error = None
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_to_embed = 0
+        self.chunks_embedded = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.owner_pid = os.getpid()  # the server process whose in-memory queue holds the job
+
+    @classmethod
+    def from_row(cls, row):
+        job = cls(None, None, None)
+        for name, value in zip(cls.FIELDS, row):
+            setattr(job, name, value)
+        return job
+
+    def to_row(self):
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "domain": self.domain,
+            "filename": self.filename,
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_to_embed": self.chunks_to_embed,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_skipped": self.chunks_total - self.chunks_to_embed if self.chunks_total else 0,
+            "queued_for": (self.started or end) - self.created,
+            "elapsed": elapsed,
+            "chunks_per_sec": self.chunks_embedded / elapsed if elapsed > 0 else 0.0,
+            "error": self.error,
+        }
+
+
+class IngestQueue:
+    """
+    Bounded queue of ingestion jobs drained by a small pool of background threads.
+    Writes to the same domain are serialized; different domains can ingest in parallel.
+    Job status lives in SQLite (INGEST_JOBS_DB), so any server worker can report on a
+    job, whichever worker queued and runs it. The queue itself is per process: each
+    server worker runs its own after fork().
+    """
+
+    def __init__(self, workers=INGEST_JOB_WORKERS, depth=INGEST_QUEUE_DEPTH, history=INGEST_JOB_HISTORY,
+                 db_path=INGEST_JOBS_DB):
+        self._depth = max(1, depth)
+        self._db_path = db_path
+        self._history = history
+        self._n_workers = max(1, workers)
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # nothing queue- or lock-like survives fork(): the master's threads are gone and a
+        # queue.Queue's conditions would still list them as waiters
+        self._queue = queue.Queue(maxsize=self._depth)
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._domain_locks = defaultdict(threading.Lock)
+        self._closed = False
+        self._fail_orphans("server restarted")
+        self._start_workers()
+
+    def _fail_orphans(self, error, own_only=False):
+        """
+        Mark failed the unfinished jobs of server processes that no longer exist (or of an
+        earlier process with our pid) and delete their uploads: their queues died with them.
+        With own_only, fail just this process's jobs (it is about to exit).
+        """
+        me = os.getpid()
+        with self._db_lock:
+            conn = self._db()
+            rows = conn.execute("SELECT id, path, owner_pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            stale = [(job_id, path) for job_id, path, pid in rows
+                     if pid == me or (not own_only and not _pid_alive(pid))]
+            if not stale:
+                return
+            conn.executemany("UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                             [(error, time.time(), job_id) for job_id, _ in stale])
+            conn.commit()
+        for _, path in stale:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, domain TEXT, filename TEXT, error TEXT, "
+                "pages_parsed INTEGER, chunks_total INTEGER, chunks_to_embed INTEGER, chunks_embedded INTEGER, "
+                "created REAL NOT NULL, started REAL, finished REAL, path TEXT, owner_pid INTEGER)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, decl in (("path", "TEXT"), ("owner_pid", "INTEGER")):
+                if name not in columns:  # job databases from before uploads were tracked per process
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _save(self, job):
+        marks = ",".join("?" * len(IngestJob.FIELDS))
+        try:
+            with self._db_lock:
+                conn = self._db()
+                conn.execute(f"INSERT OR REPLACE INTO jobs ({','.join(IngestJob.FIELDS)}) VALUES ({marks})",
+                             job.to_row())
+                conn.commit()
+        except Exception as e:
+            print(f"[!] Job {job.id}: failed to record status: {e}")
+
+    def _start_workers(self):
+        self._workers = [
+            threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            for i in range(self._n_workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    def submit(self, path, domain, filename):
+        """
+        Enqueue a file that is already on disk. Raises queue.Full when the queue is at capacity
+        or shutting down.
+        """
+        if self._closed:
+            raise queue.Full
+        job = IngestJob(path, domain, filename)
+        self._save(job)  # before a worker thread can pick it up and save "running"
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._db_lock:
+                conn = self._db()
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+                conn.commit()
+            raise
+        with self._db_lock:
+            conn = self._db()
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') "
+                "ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self._history,),
+            )
+            conn.commit()
+        return job
+
+    def get(self, job_id):
+        with self._db_lock:
+            row = self._db().execute(
+                f"SELECT {','.join(IngestJob.FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return IngestJob.from_row(row) if row else None
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def shutdown(self, timeout):
+        """
+        Stop taking jobs and give queued and running ones up to `timeout` seconds to finish.
+        Whatever is left is marked failed and its upload deleted, since the ingest threads
+        die with the process.
+        """
+        self._closed = True
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        self._fail_orphans("worker stopped", own_only=True)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        job.status = "running"
+        job.started = time.time()
+        self._save(job)
+        try:
+            documents = load_pdf(job.path)
+            job.pages_parsed = len(documents)
+            chunks = split_documents(documents)
+            job.chunks_total = len(chunks)
+            if not chunks:
+                raise ValueError("No text extracted")
+
+            def progress(embedded, to_embed):
+                job.chunks_to_embed = to_embed
+                job.chunks_embedded = embedded
+                self._save(job)
+
+            with self._domain_locks[job.domain]:
+                # uploads reference their chunks so a seed resync can't delete shared content
+                _, added = add_chunks(chunks, job.domain, progress=progress, owner=f"upload:{job.id}")
+            job.chunks_to_embed = added
+            job.chunks_embedded = added
+            job.status = "done"
+            print(f"[+] Job {job.id}: embedded {added} new of {len(chunks)} chunks from {job.filename}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"[!] Job {job.id}: failed to embed {job.filename}: {e}")
+        finally:
+            job.finished = time.time()
+            self._save(job)
+            try:
+                os.remove(job.path)
+            except Exception:
+                pass
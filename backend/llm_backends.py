@@ -0,0 +1,162 @@
+# llm_backends.py
+import os
+import re
+import time
+import torch
+from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM
+
+# torch  : plain transformers model (fp16 on CUDA, fp32 on CPU)
+# int8   : torch dynamic int8 quantization of nn.Linear (and GPT-2 Conv1D) layers (CPU)
+# onnx   : ONNX Runtime via optimum, exported once and cached on disk
+GEN_BACKEND = os.getenv("GEN_BACKEND", "torch").lower()
+BACKENDS = ("torch", "int8", "onnx")
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", "0"))  # 0 = library default
+INTER_OP_THREADS = int(os.getenv("INTER_OP_THREADS", "0"))
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "./_onnx_cache")
+
+_threads_configured = False
+
+
+def configure_threads():
+    """
+    Apply INTRA_OP_THREADS / INTER_OP_THREADS to torch. Inter-op threads can only be
+    set once per process, before any parallel work has started.
+    """
+    global _threads_configured
+    if _threads_configured:
+        return
+    if INTRA_OP_THREADS > 0:
+        torch.set_num_threads(INTRA_OP_THREADS)
+    if INTER_OP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(INTER_OP_THREADS)
+        except RuntimeError as e:
+            print(f"[!] Could not set inter-op threads: {e}")
+    _threads_configured = True
+
+
+def _torch_footprint(model):
+    total = 0
+    for value in model.state_dict().values():
+        # dynamically quantized Linear layers store their packed (int8 weight, bias) as a tuple
+        for tensor in value if isinstance(value, (tuple, list)) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def _dir_footprint(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.endswith((".onnx", ".onnx_data")):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _load_torch(model_name, model_cls):
+    use_cuda = torch.cuda.is_available()
+    return model_cls.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16 if use_cuda else torch.float32,
+        device_map="auto",
+        low_cpu_mem_usage=True
+    )
+
+
+def _conv1d_to_linear(model):
+    """
+    Replace GPT-2 style Conv1D layers (weight stored as (in, out)) with the equivalent
+    nn.Linear, which dynamic quantization knows how to handle. Returns how many were replaced.
+    """
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        return 0
+    replaced = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, bias=child.bias is not None)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(parent, name, linear)
+            replaced += 1
+    return replaced
+
+
+def _load_int8(model_name, model_cls):
+    model = model_cls.from_pretrained(model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    converted = _conv1d_to_linear(model)
+    if converted:
+        print(f"[INFO] Converted {converted} Conv1D layers to Linear for int8 quantization")
+    # An output projection tied to the input embeddings stays fp32: quantizing it would
+    # un-tie it and add a second (int8) copy of the embedding matrix
+    embeddings = model.get_input_embeddings()
+    tied = embeddings.weight if embeddings is not None else None
+    spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and module.weight is not tied
+    }
+    return torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8)
+
+
+def _load_onnx(model_name, seq2seq):
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+
+    ort_cls = ORTModelForSeq2SeqLM if seq2seq else ORTModelForCausalLM
+    options = ort.SessionOptions()
+    if INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = INTRA_OP_THREADS
+    if INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = INTER_OP_THREADS
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    export_dir = os.path.join(ONNX_CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+    if os.path.isdir(export_dir) and any(f.endswith(".onnx") for f in os.listdir(export_dir)):
+        model = ort_cls.from_pretrained(export_dir, session_options=options)
+    else:
+        print(f"[INFO] Exporting {model_name} to ONNX (one-time) ...")
+        model = ort_cls.from_pretrained(model_name, export=True, session_options=options)
+        model.save_pretrained(export_dir)
+    return model, export_dir
+
+
+def load_generation_model(model_name, seq2seq, backend=GEN_BACKEND):
+    """
+    Load the generation model with the requested backend.
+    Returns (model, info) where info has the backend name, load time and approximate weight footprint.
+    Any backend returns an object the transformers `pipeline` accepts, so the chain is unchanged.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown GEN_BACKEND '{backend}', expected one of {BACKENDS}")
+    configure_threads()
+    model_cls = AutoModelForSeq2SeqLM if seq2seq else AutoModelForCausalLM
+
+    t0 = time.time()
+    if backend == "onnx":
+        model, export_dir = _load_onnx(model_name, seq2seq)
+        footprint = _dir_footprint(export_dir)
+    elif backend == "int8":
+        model = _load_int8(model_name, model_cls)
+        footprint = _torch_footprint(model)
+    else:
+        model = _load_torch(model_name, model_cls)
+        footprint = _torch_footprint(model)
+
+    info = {
+        "backend": backend,
+        "load_seconds": time.time() - t0,
+        "weights_mb": footprint / (1024 * 1024),
+        "intra_op_threads": INTRA_OP_THREADS or torch.get_num_threads(),
+        "inter_op_threads": INTER_OP_THREADS or torch.get_num_interop_threads(),
+    }
+    print(f"[INFO] Generation backend: {info}")
+    return model, info
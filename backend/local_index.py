@@ -0,0 +1,374 @@
+# local_index.py
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows: one writing process per collection there
+    fcntl = None
+
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "./local_index")
+LOCAL_ANN_THRESHOLD = int(os.getenv("LOCAL_ANN_THRESHOLD", "50000"))  # below this: exact search
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "8"))
+_GROW_ROWS = 4096
+_SCAN_BLOCK = 65536
+
+
+def _normalize(vecs):
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=-1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+class _CollectionView:
+    """
+    The subset of chromadb's Collection API the rest of the backend relies on.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self.name = store.collection_name
+
+    def count(self):
+        return self._store.count()
+
+    def query(self, query_embeddings, n_results=4, include=None):
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for vec in query_embeddings:
+            hits = self._store._search(vec, n_results)
+            out["ids"].append([h[0] for h in hits])
+            out["documents"].append([h[1] for h in hits])
+            out["metadatas"].append([h[2] for h in hits])
+            out["distances"].append([h[3] for h in hits])
+        return out
+
+
+class LocalVectorStore(VectorStore):
+    """
+    File-backed vector store: float16 vectors in a memory-mapped file, metadata in SQLite,
+    exact search for small collections and an IVF index (also memory-mapped) once a
+    collection passes LOCAL_ANN_THRESHOLD rows. Readers in other processes map the same
+    files read-only and pick up new rows through state.json. Writers, in any process,
+    serialize on an flock of <collection>/.lock.
+
+    Layout of <LOCAL_INDEX_PATH>/<collection>/:
+        vectors.f16       (rows, dim) float16, L2-normalized
+        meta.sqlite       row -> id, document, metadata, deleted flag
+        ivf_centroids.npy (nlist, dim) float32
+        ivf_assign.i32    (rows,) cluster of each row (turned into per-list row arrays in memory)
+        state.json        {"dim", "rows", "capacity", "ivf_rows"}
+        .lock             flock'ed for the duration of every write
+    """
+
+    def __init__(self, collection_name, embedding_function, root=LOCAL_INDEX_PATH):
+        self.collection_name = collection_name
+        self._embedding = embedding_function
+        self.path = os.path.join(root, collection_name)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.path, "meta.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+            "document TEXT, metadata TEXT, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+        self._state_mtime = None
+        self._state = {"dim": None, "rows": 0, "capacity": 0, "ivf_rows": 0}
+        self._vectors = None
+        self._deleted = np.zeros(0, dtype=bool)
+        self._centroids = None
+        self._assign = None
+        self._ivf_rows = 0
+        self._lists = None  # IVF inverted lists: row numbers per centroid, covering rows < _listed
+        self._listed = 0
+        self._collection = _CollectionView(self)
+        self._refresh()
+
+    # ===== files / state =====
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _refresh(self):
+        """
+        Re-map files if another process (or this one) changed state.json since the last look.
+        """
+        state_path = self._file("state.json")
+        try:
+            mtime = os.stat(state_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._state_mtime:
+            return
+        with open(state_path, "r", encoding="utf-8") as f:
+            self._state = json.load(f)
+        self._state_mtime = mtime
+        dim, capacity = self._state["dim"], self._state["capacity"]
+        self._vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r", shape=(capacity, dim)) \
+            if capacity else None
+        deleted = np.zeros(self._state["rows"], dtype=bool)
+        rows = [r for (r,) in self._conn.execute("SELECT row FROM rows WHERE deleted = 1")]
+        deleted[[r for r in rows if r < len(deleted)]] = True
+        self._deleted = deleted
+        ivf_rows = self._state.get("ivf_rows")
+        if ivf_rows and os.path.exists(self._file("ivf_centroids.npy")):
+            if self._centroids is None or ivf_rows != self._ivf_rows:
+                # (re)built since the last look: every row may have moved to another list
+                self._centroids = np.load(self._file("ivf_centroids.npy"))
+                self._ivf_rows = ivf_rows
+                self._lists = None
+            self._assign = np.memmap(self._file("ivf_assign.i32"), dtype=np.int32, mode="r",
+                                     shape=(capacity,))
+            self._update_lists()
+        else:
+            self._centroids = None
+            self._assign = None
+            self._lists = None
+
+    def _update_lists(self):
+        """
+        Extend the inverted lists with rows assigned since the last look (all rows after a build).
+        """
+        n, nlist = self._state["rows"], len(self._centroids)
+        if self._lists is None:
+            self._lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+            self._listed = 0
+        if n <= self._listed:
+            return
+        labels = np.asarray(self._assign[self._listed:n])
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        for c in np.nonzero(np.diff(bounds))[0]:
+            self._lists[c] = np.concatenate([self._lists[c], order[bounds[c]:bounds[c + 1]] + self._listed])
+        self._listed = n
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Hold the thread lock and an exclusive flock on the collection, then re-read
+        state.json, so row numbers and the deleted set reflect every other writer.
+        """
+        with self._lock:
+            lock_file = open(self._file(".lock"), "a") if fcntl is not None else None
+            try:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._state_mtime = None  # mtime granularity can hide a write made just now
+                self._refresh()
+                yield
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def _write_state(self):
+        tmp = self._file("state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f)
+        os.replace(tmp, self._file("state.json"))
+        self._state_mtime = None
+        self._refresh()
+
+    def _ensure_capacity(self, dim, needed):
+        if self._state["dim"] is None:
+            self._state["dim"] = dim
+        elif self._state["dim"] != dim:
+            raise ValueError(f"Vector dim {dim} does not match collection dim {self._state['dim']}")
+        capacity = self._state["capacity"]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, _GROW_ROWS)
+        for name, itemsize in (("vectors.f16", 2 * dim), ("ivf_assign.i32", 4)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(new_capacity * itemsize)
+        self._state["capacity"] = new_capacity
+
+    # ===== writes =====
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        vectors = _normalize(vectors)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        with self._write_lock():
+            seen = set(self._existing_ids(ids))
+            keep = []
+            for i, cid in enumerate(ids):
+                if cid not in seen:
+                    seen.add(cid)
+                    keep.append(i)
+            if not keep:
+                return ids
+            start = self._state["rows"]
+            end = start + len(keep)
+            self._ensure_capacity(vectors.shape[1], end)
+            capacity, dim = self._state["capacity"], self._state["dim"]
+            out = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, dim))
+            out[start:end] = vectors[keep].astype(np.float16)
+            out.flush()
+            if self._centroids is not None:
+                assign = np.memmap(self._file("ivf_assign.i32"), dtype=np.int32, mode="r+", shape=(capacity,))
+                assign[start:end] = np.argmax(vectors[keep] @ self._centroids.T, axis=1)
+                assign.flush()
+            self._conn.executemany(
+                "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(start + j, ids[i], texts[i], json.dumps(metadatas[i] or {})) for j, i in enumerate(keep)],
+            )
+            self._conn.commit()
+            self._state["rows"] = end
+            if end >= LOCAL_ANN_THRESHOLD and end > 2 * self._state.get("ivf_rows", 0):
+                self._build_ivf()
+            self._write_state()
+        return ids
+
+    def _build_ivf(self, iterations=10):
+        """
+        Train k-means centroids on a sample of rows and assign every row to its nearest centroid.
+        """
+        n, dim, capacity = self._state["rows"], self._state["dim"], self._state["capacity"]
+        vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r", shape=(capacity, dim))
+        nlist = min(n, max(16, int(np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample = vectors[np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        assign = np.memmap(self._file("ivf_assign.i32"), dtype=np.int32, mode="r+", shape=(capacity,))
+        for start in range(0, n, _SCAN_BLOCK):
+            block = vectors[start:min(start + _SCAN_BLOCK, n)].astype(np.float32)
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        assign.flush()
+        np.save(self._file("ivf_centroids.npy"), centroids)
+        self._state["ivf_rows"] = n
+        print(f"[INFO] Built IVF index for {self.collection_name}: {n} rows, {nlist} lists")
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return None
+        with self._write_lock():
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"UPDATE rows SET deleted = 1 WHERE id IN ({marks})", batch)
+                # free the id so identical content can be added again later
+                self._conn.execute(f"UPDATE rows SET id = id || ':deleted:' || row WHERE id IN ({marks})", batch)
+            self._conn.commit()
+            self._write_state()
+        return True
+
+    # ===== reads =====
+
+    def _existing_ids(self, ids):
+        found = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ",".join("?" * len(batch))
+            found += [r for (r,) in self._conn.execute(
+                f"SELECT id FROM rows WHERE deleted = 0 AND id IN ({marks})", batch)]
+        return found
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return int(self._state["rows"] - self._deleted.sum())
+
+    def _candidate_scores(self, q):
+        n = self._state["rows"]
+        if self._centroids is not None and self._state.get("ivf_rows"):
+            probe = np.argsort(-(self._centroids @ q))[:LOCAL_IVF_NPROBE]
+            rows = np.sort(np.concatenate([self._lists[c] for c in probe]))  # sorted: sequential memmap reads
+            scores = self._vectors[rows].astype(np.float32) @ q if len(rows) else np.zeros(0, np.float32)
+            return rows, scores
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _SCAN_BLOCK):
+            stop = min(start + _SCAN_BLOCK, n)  # rows past n are preallocated capacity
+            scores[start:stop] = self._vectors[start:stop].astype(np.float32) @ q
+        return np.arange(n), scores
+
+    def _search(self, vector, k):
+        """
+        Top-k rows for a query vector as (id, document, metadata, cosine distance).
+        """
+        with self._lock:
+            self._refresh()
+            if not self._state["rows"]:
+                return []
+            q = _normalize(vector)
+            rows, scores = self._candidate_scores(q)
+            if len(rows):
+                scores = np.where(self._deleted[rows], -np.inf, scores)
+            k = min(k, len(rows))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = [i for i in top if np.isfinite(scores[i])]
+            picked = [int(rows[i]) for i in top]
+            marks = ",".join("?" * len(picked))
+            meta = {r: (cid, doc, md) for r, cid, doc, md in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM rows WHERE row IN ({marks})", picked)} if picked else {}
+        return [(meta[r][0], meta[r][1], json.loads(meta[r][2] or "{}"), float(1.0 - scores[i]))
+                for r, i in zip(picked, top) if r in meta]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [Document(page_content=doc or "", metadata=md) for _, doc, md, _ in self._search(embedding, k)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        return [(Document(page_content=doc or "", metadata=md), dist) for _, doc, md, dist in self._search(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        hits = self._search(self._embedding.embed_query(query), k)
+        return [(Document(page_content=doc or "", metadata=md), dist) for _, doc, md, dist in hits]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    def get(self, ids=None, include=None, **kwargs):
+        """
+        Chroma-style get(): {"ids", "documents", "metadatas"} for live rows (optionally by id).
+        """
+        sql = "SELECT id, document, metadata FROM rows WHERE deleted = 0"
+        params = []
+        if ids:
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params = list(ids)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY row", params).fetchall()
+        include = ["documents", "metadatas"] if include is None else include
+        return {
+            "ids": [r[0] for r in rows],
+            "documents": [r[1] for r in rows] if "documents" in include else None,
+            "metadatas": [json.loads(r[2] or "{}") for r in rows] if "metadatas" in include else None,
+        }
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, collection_name="local", ids=None, **kwargs):
+        store = cls(collection_name, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
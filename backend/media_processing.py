@@ -1,100 +1,369 @@
 #media_processing.py
+import io
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+import numpy as np
 import cv2
 import pytesseract
 from PIL import Image
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, decode_audio
 from moviepy.editor import VideoFileClip
 
 # Optional: point Tesseract if needed on Windows
 # pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
 
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "tiny")
+VIDEO_EVERY_N_SECONDS = int(os.getenv("VIDEO_EVERY_N_SECONDS", "5"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "6"))
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.35"))  # Bhattacharyya distance
+VIDEO_SCENE_CHECK_SECONDS = float(os.getenv("VIDEO_SCENE_CHECK_SECONDS", "0.5"))
+VIDEO_OCR_DUP_RATIO = float(os.getenv("VIDEO_OCR_DUP_RATIO", "0.9"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "4"))
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "./_media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
 _WHISPER = None
+_WHISPER_LOCK = threading.Lock()
+
+def _after_fork():
+    # CTranslate2 runs Whisper on worker threads created at load time, which a forked
+    # child doesn't have, so each server worker loads its own copy
+    global _WHISPER, _WHISPER_LOCK
+    _WHISPER = None
+    _WHISPER_LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
 
 def _ensure_whisper():
     global _WHISPER
     if _WHISPER is None:
-        # choose small for speed; change to "base" or "small" if you prefer
-        _WHISPER = WhisperModel("tiny", device="cpu", compute_type="int8")
+        with _WHISPER_LOCK:
+            if _WHISPER is None:
+                # choose small for speed; change to "base" or "small" if you prefer
+                _WHISPER = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
     return _WHISPER
 
 
-def extract_text_from_image(path: str) -> str:
+class MediaCache:
+    """
+    Disk-backed, size-bounded LRU cache of extracted text, keyed by file content hash
+    plus the extractor settings that affect the output.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None  # key -> size, least recently used first
+        self._size = 0
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".txt"):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._size = sum(self._index.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    def get(self, key):
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    text = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                self._size -= self._index.pop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        data = text.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._load_index()
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self._size += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._size > self.max_bytes and self._index:
+                old_key, old_size = self._index.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._index or {}),
+                "bytes": self._size,
+            }
+
+
+class FailedExtraction(str):
+    """
+    Text an extractor returns when it failed ("[image OCR failed: ...]", or a video with
+    a failed part). It still reaches the prompt, but is never cached.
+    """
+
+
+_cache = MediaCache()
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_media_cache_stats():
+    return _cache.stats()
+
+
+def extract_text_from_image(path) -> str:
     try:
         img = Image.open(path)
         text = pytesseract.image_to_string(img)
         return text.strip()
     except Exception as e:
-        return f"[image OCR failed: {e}]"
+        return FailedExtraction(f"[image OCR failed: {e}]")
 
 
-def extract_text_from_audio(path: str) -> str:
+def extract_text_from_audio(path) -> str:
+    """
+    Transcribe an audio file path, or 16 kHz mono float32 PCM already decoded in memory.
+    """
     try:
         model = _ensure_whisper()
         segments, info = model.transcribe(path, beam_size=1)
         return " ".join(seg.text for seg in segments).strip()
     except Exception as e:
-        return f"[audio transcription failed: {e}]"
+        return FailedExtraction(f"[audio transcription failed: {e}]")
 
 
-def _sample_video_frames(path: str, every_n_seconds: int = 5, max_frames: int = 6):
-    frames_text = []
+def _frame_signature(frame):
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36))
+    hist = cv2.calcHist([small], [0], None, [32], [0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def _select_video_frames(path: str, every_n_seconds: int = VIDEO_EVERY_N_SECONDS, max_frames: int = VIDEO_MAX_FRAMES):
+    """
+    Decode the video forward once and keep frames at scene changes, falling back to one
+    frame every `every_n_seconds` when nothing changes. Frames that are not inspected are
+    only grabbed, never converted.
+    """
+    selected = []
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return selected
     try:
-        cap = cv2.VideoCapture(path)
-        if not cap.isOpened():
-            return frames_text
         fps = cap.get(cv2.CAP_PROP_FPS) or 25
-        step = int(fps * every_n_seconds)
+        check_every = max(1, int(fps * VIDEO_SCENE_CHECK_SECONDS))
+        fallback_gap = max(1, int(fps * every_n_seconds))
         idx = 0
-        grabbed = 0
-        while True and grabbed < max_frames:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-            ret, frame = cap.read()
-            if not ret:
+        last_pick = None
+        last_sig = None
+        while len(selected) < max_frames:
+            if not cap.grab():
                 break
-            # OCR the frame after converting to RGB PIL
-            pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            text = pytesseract.image_to_string(pil)
-            if text.strip():
-                frames_text.append(text.strip())
-            idx += step
-            grabbed += 1
+            if idx % check_every == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                sig = _frame_signature(frame)
+                changed = last_sig is None or cv2.compareHist(last_sig, sig, cv2.HISTCMP_BHATTACHARYYA) > VIDEO_SCENE_THRESHOLD
+                due = last_pick is None or idx - last_pick >= fallback_gap
+                if changed or due:
+                    selected.append(frame)
+                    last_pick = idx
+                    last_sig = sig
+            idx += 1
+    finally:
         cap.release()
-    except Exception:
-        pass
+    return selected
+
+
+def _ocr_frame(frame):
+    # OCR the frame after converting to RGB PIL
+    pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    return pytesseract.image_to_string(pil).strip()
+
+
+def _normalize_ocr(text):
+    return " ".join(text.lower().split())
+
+
+def _sample_video_frames(path: str, every_n_seconds: int = VIDEO_EVERY_N_SECONDS, max_frames: int = VIDEO_MAX_FRAMES):
+    frames_text = []
+    frames = _select_video_frames(path, every_n_seconds, max_frames)
+    if not frames:
+        return frames_text
+    # tesseract runs as a subprocess, so threads give real parallelism here
+    with ThreadPoolExecutor(max_workers=min(OCR_WORKERS, len(frames))) as pool:
+        texts = list(pool.map(_ocr_frame, frames))
+    previous = None
+    for text in texts:
+        norm = _normalize_ocr(text)
+        if not norm:
+            continue
+        if previous is not None and SequenceMatcher(None, previous, norm).ratio() >= VIDEO_OCR_DUP_RATIO:
+            continue  # same on-screen text as the previous kept frame
+        frames_text.append(text)
+        previous = norm
     return frames_text
 
 
-def extract_text_from_video(path: str) -> str:
-    # 1) OCR a few frames for on-screen text
-    ocr_chunks = _sample_video_frames(path)
-    # 2) Extract audio -> transcribe
-    audio_text = ""
+def _decode_audio_pcm(path: str):
+    """
+    Decode a media file's audio track straight to 16 kHz mono float32, without a temp WAV.
+    """
     try:
+        return decode_audio(path, sampling_rate=16000)
+    except Exception:
+        # PyAV could not read the container; let moviepy/ffmpeg decode it instead
         clip = VideoFileClip(path)
-        audio_path = path + ".wav"
-        clip.audio.write_audiofile(audio_path, logger=None)
-        audio_text = extract_text_from_audio(audio_path)
         try:
-            os.remove(audio_path)
-        except Exception:
-            pass
+            if clip.audio is None:
+                return None
+            pcm = clip.audio.to_soundarray(fps=16000)
+        finally:
+            clip.close()
+        if pcm.ndim > 1:
+            pcm = pcm.mean(axis=1)
+        return pcm.astype(np.float32)
+
+
+def _transcribe_video_audio(path: str) -> str:
+    try:
+        pcm = _decode_audio_pcm(path)
     except Exception as e:
-        audio_text = f"[video audio extract failed: {e}]"
+        return FailedExtraction(f"[video audio extract failed: {e}]")
+    if pcm is None or len(pcm) == 0:
+        return ""
+    return extract_text_from_audio(pcm)
+
+
+def extract_text_from_video(path: str) -> str:
+    # OCR of sampled frames and audio transcription run side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ocr_future = pool.submit(_sample_video_frames, path)
+        audio_future = pool.submit(_transcribe_video_audio, path)
+        try:
+            ocr_chunks = ocr_future.result()
+            ocr_failed = False
+        except Exception:
+            # keep whatever the audio track gives, but don't cache a result missing its OCR
+            ocr_chunks = []
+            ocr_failed = True
+        audio_text = audio_future.result()
     parts = []
     if ocr_chunks:
         parts.append("OCR:\n" + "\n".join(ocr_chunks))
     if audio_text:
         parts.append("Audio:\n" + audio_text)
-    return "\n\n".join(parts).strip()
+    text = "\n\n".join(parts).strip()
+    if ocr_failed or isinstance(audio_text, FailedExtraction):
+        return FailedExtraction(text)
+    return text
 
 
-def extract_text_from_file(path: str) -> str:
-    ext = os.path.splitext(path)[1].lower()
+def _extractor_for(ext):
+    """
+    (kind, extractor, settings) for a file extension; settings go into the cache key.
+    """
     if ext in [".png", ".jpg", ".jpeg", ".bmp", ".tiff"]:
-        return extract_text_from_image(path)
+        return "image", extract_text_from_image, "tesseract"
     if ext in [".wav", ".mp3", ".m4a", ".flac", ".ogg"]:
-        return extract_text_from_audio(path)
+        return "audio", extract_text_from_audio, f"whisper={WHISPER_MODEL}"
     if ext in [".mp4", ".mov", ".avi", ".mkv", ".webm"]:
-        return extract_text_from_video(path)
-    return ""
+        settings = (f"whisper={WHISPER_MODEL};every={VIDEO_EVERY_N_SECONDS};frames={VIDEO_MAX_FRAMES};"
+                    f"scene={VIDEO_SCENE_THRESHOLD}/{VIDEO_SCENE_CHECK_SECONDS};dup={VIDEO_OCR_DUP_RATIO}")
+        return "video", extract_text_from_video, settings
+    return None, None, None
+
+
+def _cached_extract(digest, kind, settings, run):
+    key = hashlib.sha256(f"{digest}|{kind}|{settings}".encode("utf-8")).hexdigest()
+    try:
+        cached = _cache.get(key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached
+    text = run()
+    if not isinstance(text, FailedExtraction):
+        try:
+            _cache.put(key, text)
+        except Exception as e:
+            print(f"[!] Could not cache media extraction: {e}")
+    return text
+
+
+def extract_text_from_file(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    kind, extractor, settings = _extractor_for(ext)
+    if extractor is None:
+        return ""
+    try:
+        digest = _file_sha256(path)
+    except Exception:
+        return extractor(path)
+    return _cached_extract(digest, kind, settings, lambda: extractor(path))
+
+
+def media_kind(filename: str):
+    """
+    "image", "audio", "video" or None for unsupported files.
+    """
+    kind, _, _ = _extractor_for(os.path.splitext(filename)[1].lower())
+    return kind
+
+
+def needs_file_path(filename: str) -> bool:
+    """
+    True for media that can only be read from disk (video goes through OpenCV).
+    """
+    return media_kind(filename) == "video"
+
+
+def extract_text_from_bytes(data: bytes, filename: str) -> str:
+    """
+    Like extract_text_from_file() for images and audio held in memory, with no temp file.
+    """
+    kind, extractor, settings = _extractor_for(os.path.splitext(filename)[1].lower())
+    if extractor is None:
+        return ""
+    if kind == "video":
+        raise ValueError("video extraction needs a file path")
+    digest = hashlib.sha256(data).hexdigest()
+    return _cached_extract(digest, kind, settings, lambda: extractor(io.BytesIO(data)))
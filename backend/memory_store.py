@@ -1,77 +1,440 @@
 import os
 import json
-from langchain.memory import ConversationBufferMemory
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+import numpy as np
 
-# Path to store memory
+# Legacy single-conversation memory file, migrated into DEFAULT_SESSION on first use
 MEMORY_PATH = "chat_memory.json"
 
-def save_memory(memory):
+# Per-session conversation store (append-only SQLite log)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "chat_sessions.db")
+SESSION_WINDOW = int(os.getenv("SESSION_WINDOW", "20"))  # messages kept in RAM per session
+SESSION_WINDOW_CACHE = int(os.getenv("SESSION_WINDOW_CACHE", "1000"))  # sessions whose window stays in RAM
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "200"))  # kept on disk per session
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))  # idle sessions older than this are dropped
+SESSION_COMPACT_INTERVAL = int(os.getenv("SESSION_COMPACT_INTERVAL", "600"))
+DEFAULT_SESSION = "default"
+
+# Long-term memory: past exchanges with a float16 vector each, kept per session in the session DB.
+# The older process-wide stores (JSON list, then JSON lines + .f16 vectors) are migrated on first use.
+LONG_TERM_LEGACY_PATH = "memory_store.json"
+LONG_TERM_PATH = os.getenv("LONG_TERM_PATH", "memory_store.jsonl")
+LONG_TERM_VECTORS_PATH = LONG_TERM_PATH + ".f16"
+LONG_TERM_MAX_PER_SESSION = int(os.getenv("LONG_TERM_MAX_PER_SESSION", "500"))  # newest exchanges searched/kept
+LONG_TERM_CACHE_SESSIONS = int(os.getenv("LONG_TERM_CACHE_SESSIONS", "256"))  # sessions whose vectors stay in RAM
+
+_session_conn = None
+_session_lock = threading.RLock()
+_session_windows = OrderedDict()  # LRU: session_id -> (last turn id, deque of recent messages)
+_compactor = None
+_long_term_migrated = False
+
+
+def _after_fork():
+    # each forked server worker opens its own connection and caches; the compactor stays in the parent
+    global _session_conn, _session_lock, _session_windows
+    _session_conn = None
+    _session_lock = threading.RLock()
+    _session_windows = OrderedDict()
+    _long_term.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _ensure_session_db():
+    global _session_conn
+    if _session_conn is None:
+        conn = sqlite3.connect(SESSION_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_turns_session ON turns(session_id, id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS long_term ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "user_text TEXT NOT NULL, bot_text TEXT NOT NULL, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_long_term_session ON long_term(session_id, id)")
+        conn.commit()
+        _migrate_chat_memory(conn)
+        _session_conn = conn
+    return _session_conn
+
+
+def _migrate_chat_memory(conn):
     """
-    Save conversation memory to a JSON file.
+    Move the old single-conversation chat_memory.json (LangChain message list) into the
+    turns of DEFAULT_SESSION. The write lock is taken first so only one worker migrates.
     """
+    if not os.path.exists(MEMORY_PATH):
+        return
     try:
-        messages = []
-        for m in memory.chat_memory.messages:
-            messages.append({
-                "type": m.__class__.__name__,
-                "content": m.content
-            })
+        conn.execute("BEGIN IMMEDIATE")
+        if not os.path.exists(MEMORY_PATH):
+            conn.rollback()
+            return
+        with open(MEMORY_PATH, "r", encoding="utf-8") as f:
+            messages = json.load(f) or []
+        created = os.path.getmtime(MEMORY_PATH)
+        roles = {"HumanMessage": "user", "AIMessage": "bot"}
+        rows = [(DEFAULT_SESSION, roles[m["type"]], m.get("content", ""), created)
+                for m in messages if m.get("type") in roles]
+        conn.executemany("INSERT INTO turns (session_id, role, content, created) VALUES (?, ?, ?, ?)", rows)
+        os.remove(MEMORY_PATH)
+        conn.commit()
+        print(f"[INFO] Migrated {len(rows)} messages from {MEMORY_PATH} to session '{DEFAULT_SESSION}'")
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Failed to migrate {MEMORY_PATH}: {e}")
 
-        with open(MEMORY_PATH, "w", encoding="utf-8") as f:
-            json.dump(messages, f, indent=2)
 
-        print(f"[INFO] Memory saved to {MEMORY_PATH}")
+def _session_window(session_id):
+    """
+    Recent messages for a session. The cached window is checked against the session's
+    newest turn id on every access (one index lookup), so turns appended or deleted by
+    other server workers are picked up. At most SESSION_WINDOW_CACHE windows are kept;
+    the least recently used one is dropped first.
+    """
+    conn = _ensure_session_db()
+    last_id = conn.execute("SELECT MAX(id) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+    cached = _session_windows.get(session_id)
+    if cached is not None and cached[0] == last_id:
+        _session_windows.move_to_end(session_id)
+        return cached[1]
+    rows = conn.execute(
+        "SELECT role, content FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+        (session_id, SESSION_WINDOW),
+    ).fetchall()
+    window = deque(({"role": r, "content": c} for r, c in reversed(rows)), maxlen=SESSION_WINDOW)
+    _session_windows[session_id] = (last_id, window)
+    _session_windows.move_to_end(session_id)
+    while len(_session_windows) > max(SESSION_WINDOW_CACHE, 1):
+        _session_windows.popitem(last=False)
+    return window
 
+
+def append_turn(session_id, user_text, bot_text):
+    """
+    Append one user/bot exchange to a session. Cost does not depend on history length.
+    """
+    session_id = session_id or DEFAULT_SESSION
+    now = time.time()
+    try:
+        with _session_lock:
+            conn = _ensure_session_db()
+            conn.executemany(
+                "INSERT INTO turns (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                [(session_id, "user", user_text, now), (session_id, "bot", bot_text, now)],
+            )
+            conn.commit()
     except Exception as e:
-        print(f"[ERROR] Failed to save memory: {e}")
+        print(f"[ERROR] Failed to append turn for session '{session_id}': {e}")
 
 
-def load_memory():
+def get_recent_messages(session_id, n_messages):
     """
-    Load conversation memory from the JSON file, if it exists.
+    Return the last `n_messages` messages of a session as {"role", "content"} dicts.
     """
+    session_id = session_id or DEFAULT_SESSION
     try:
-        if os.path.exists(MEMORY_PATH):
-            with open(MEMORY_PATH, "r", encoding="utf-8") as f:
-                messages_data = json.load(f)
-
-            memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-            for m in messages_data:
-                if m["type"] == "HumanMessage":
-                    from langchain.schema import HumanMessage
-                    memory.chat_memory.add_user_message(m["content"])
-                elif m["type"] == "AIMessage":
-                    from langchain.schema import AIMessage
-                    memory.chat_memory.add_ai_message(m["content"])
-            print(f"[INFO] Memory loaded from {MEMORY_PATH}")
-            return memory
+        with _session_lock:
+            window = list(_session_window(session_id))
+        return window[-n_messages:] if n_messages > 0 else []
     except Exception as e:
-        print(f"[ERROR] Failed to load memory: {e}")
+        print(f"[ERROR] Failed to load session '{session_id}': {e}")
+        return []
+
+
+def forget_session(session_id):
+    """
+    Delete every stored message and long-term memory entry of one session.
+    """
+    session_id = session_id or DEFAULT_SESSION
+    try:
+        with _session_lock:
+            conn = _ensure_long_term()
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM long_term WHERE session_id = ?", (session_id,))
+            conn.commit()
+            _session_windows.pop(session_id, None)
+            _long_term.drop(session_id)
+    except Exception as e:
+        print(f"[ERROR] Failed to forget session '{session_id}': {e}")
+
+
+def clear_sessions():
+    """
+    Delete every stored message of every session.
+    """
+    try:
+        with _session_lock:
+            conn = _ensure_session_db()
+            conn.execute("DELETE FROM turns")
+            conn.commit()
+            _session_windows.clear()
+        print("[INFO] All sessions cleared.")
+    except Exception as e:
+        print(f"[ERROR] Failed to clear sessions: {e}")
+
+
+def compact_sessions():
+    """
+    Drop idle sessions past SESSION_TTL and trim the rest to SESSION_MAX_MESSAGES
+    messages and LONG_TERM_MAX_PER_SESSION long-term entries.
+    """
+    try:
+        cutoff = time.time() - SESSION_TTL
+        with _session_lock:
+            conn = _ensure_session_db()
+            stale = [r[0] for r in conn.execute(
+                "SELECT session_id FROM turns GROUP BY session_id HAVING MAX(created) < ?", (cutoff,)
+            )]
+            conn.executemany("DELETE FROM turns WHERE session_id = ?", [(sid,) for sid in stale])
+            conn.execute(
+                "DELETE FROM turns WHERE id IN ("
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id DESC) AS rn "
+                "FROM turns) WHERE rn > ?)",
+                (SESSION_MAX_MESSAGES,),
+            )
+            conn.execute(
+                "DELETE FROM long_term WHERE session_id IN ("
+                "SELECT session_id FROM long_term GROUP BY session_id HAVING MAX(created) < ?)",
+                (cutoff,),
+            )
+            conn.execute(
+                "DELETE FROM long_term WHERE id IN ("
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id DESC) AS rn "
+                "FROM long_term) WHERE rn > ?)",
+                (LONG_TERM_MAX_PER_SESSION,),
+            )
+            conn.commit()
+            for sid in stale:
+                _session_windows.pop(sid, None)
+        if stale:
+            print(f"[INFO] Compacted {len(stale)} idle sessions.")
+    except Exception as e:
+        print(f"[ERROR] Session compaction failed: {e}")
+
+
+def start_session_compactor(interval=SESSION_COMPACT_INTERVAL):
+    """
+    Run compact_sessions() every `interval` seconds on a daemon thread.
+    """
+    global _compactor
+    if _compactor is not None or interval <= 0:
+        return
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            compact_sessions()
+
+    _compactor = threading.Thread(target=_loop, name="session-compactor", daemon=True)
+    _compactor.start()
 
-    return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
 
+def _memory_text(entry):
+    return f"User: {entry.get('user', '')}\nBot: {entry.get('bot', '')}"
 
-def create_memory():
+
+def _embed_texts(texts, is_query=False):
     """
-    Create a new ConversationBufferMemory.
+    Embed and L2-normalize texts with the shared embedding model.
     """
-    return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-def get_relevant_memory(query, top_k=3):
+    from get_vector_db import _ensure_embedding
+    embedding = _ensure_embedding()
+    if is_query:
+        vecs = np.asarray([embedding.embed_query(t) for t in texts], dtype=np.float32)
+    else:
+        vecs = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+def _migrate_long_term(conn):
     """
-    Retrieve the most relevant memory entries for the given query.
-    This is a placeholder that just returns the last `top_k` messages.
-    You can replace this with an embedding-based similarity search.
+    Move entries of the old process-wide store into the long_term table. They were
+    written without a session, so they are attributed to DEFAULT_SESSION only.
+    The write lock is taken first so only one worker migrates.
     """
+    legacy = [p for p in (LONG_TERM_PATH, LONG_TERM_VECTORS_PATH, LONG_TERM_LEGACY_PATH) if os.path.exists(p)]
+    if not legacy:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    entries = []
+    if os.path.exists(LONG_TERM_PATH):
+        with open(LONG_TERM_PATH, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    elif os.path.exists(LONG_TERM_LEGACY_PATH):
+        with open(LONG_TERM_LEGACY_PATH, "r", encoding="utf-8") as f:
+            entries = json.load(f) or []
+    if entries:
+        vecs = _embed_texts([_memory_text(e) for e in entries]).astype(np.float16)
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO long_term (session_id, user_text, bot_text, vector, created) VALUES (?, ?, ?, ?, ?)",
+            [(DEFAULT_SESSION, e.get("user", ""), e.get("bot", ""), v.tobytes(), now) for e, v in zip(entries, vecs)],
+        )
+        print(f"[INFO] Migrated {len(entries)} long-term memory entries to session '{DEFAULT_SESSION}'")
+    for path in (LONG_TERM_PATH, LONG_TERM_VECTORS_PATH, LONG_TERM_LEGACY_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    conn.commit()
+
+
+def _ensure_long_term():
+    global _long_term_migrated
+    conn = _ensure_session_db()
+    if not _long_term_migrated:
+        try:
+            _migrate_long_term(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        _long_term_migrated = True
+    return conn
+
+
+class _LongTermVectors:
+    """
+    Per-session float16 matrices of long-term memory vectors. A session's matrix is read
+    from SQLite once, then grows in place with rows newer than its last id. Each use checks
+    the session's (min id, max id) in one index lookup, so rows added, trimmed or deleted
+    by other server workers are picked up. At most LONG_TERM_CACHE_SESSIONS stay in RAM.
+    Callers hold _session_lock.
+    """
+
+    def __init__(self, max_sessions=LONG_TERM_CACHE_SESSIONS):
+        self.max_sessions = max(max_sessions, 1)
+        self._sessions = OrderedDict()  # session_id -> {"min_id", "max_id", "entries", "vectors", "count"}
+
+    @staticmethod
+    def _append(cached, rows):
+        dim = cached["vectors"].shape[1] if cached["vectors"] is not None else None
+        for _, user_text, bot_text, blob in rows:
+            vec = np.frombuffer(blob, dtype=np.float16)
+            if dim is None:
+                dim = vec.size
+                cached["vectors"] = np.zeros((64, dim), dtype=np.float16)
+            if vec.size != dim:
+                continue  # written with a previous embedding model
+            if cached["count"] == len(cached["vectors"]):
+                grown = np.zeros((2 * len(cached["vectors"]), dim), dtype=np.float16)
+                grown[:cached["count"]] = cached["vectors"][:cached["count"]]
+                cached["vectors"] = grown
+            cached["vectors"][cached["count"]] = vec
+            cached["entries"].append({"user": user_text, "bot": bot_text})
+            cached["count"] += 1
+
+    def get(self, conn, session_id):
+        """
+        (entries, float16 matrix with one row per entry) for a session, up to date with SQLite.
+        """
+        lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM long_term WHERE session_id = ?", (session_id,)).fetchone()
+        cached = self._sessions.get(session_id)
+        if cached is None or cached["min_id"] != lo or (hi or 0) < cached["max_id"]:
+            rows = conn.execute(
+                "SELECT id, user_text, bot_text, vector FROM long_term WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, LONG_TERM_MAX_PER_SESSION),
+            ).fetchall()
+            cached = {"min_id": lo, "max_id": hi or 0, "entries": [], "vectors": None, "count": 0}
+            self._append(cached, reversed(rows))
+        elif (hi or 0) > cached["max_id"]:
+            self._append(cached, conn.execute(
+                "SELECT id, user_text, bot_text, vector FROM long_term WHERE session_id = ? AND id > ? ORDER BY id",
+                (session_id, cached["max_id"]),
+            ).fetchall())
+            cached["max_id"] = hi
+        self._sessions[session_id] = cached
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        n = cached["count"]
+        matrix = cached["vectors"][:n] if n else np.zeros((0, 0), dtype=np.float16)
+        return cached["entries"][:n], matrix
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def drop(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def clear(self):
+        self._sessions.clear()
+
+
+_long_term = _LongTermVectors()
+
+
+def add_long_term_memory(user_text, bot_text, session_id=DEFAULT_SESSION):
+    """
+    Embed one exchange and add it to the session's long-term memory.
+    """
+    session_id = session_id or DEFAULT_SESSION
+    try:
+        vec = _embed_texts([_memory_text({"user": user_text, "bot": bot_text})])[0].astype(np.float16)
+        with _session_lock:
+            conn = _ensure_long_term()
+            conn.execute(
+                "INSERT INTO long_term (session_id, user_text, bot_text, vector, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, user_text, bot_text, vec.tobytes(), time.time()),
+            )
+            conn.commit()
+            if session_id in _long_term:
+                _long_term.get(conn, session_id)  # append the new row to the cached matrix
+    except Exception as e:
+        print(f"[ERROR] Failed to add long-term memory for session '{session_id}': {e}")
+
+
+def get_relevant_memory(query, top_k=3, session_id=DEFAULT_SESSION):
+    """
+    Retrieve the `top_k` past exchanges of a session most similar to the query (cosine
+    similarity against the session's cached float16 matrix, in one matrix product).
+    """
+    session_id = session_id or DEFAULT_SESSION
+    if top_k <= 0:
+        return []
     try:
-        if os.path.exists("memory_store.json"):
-            with open("memory_store.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return data[-top_k:] if data else []
+        with _session_lock:
+            entries, matrix = _long_term.get(_ensure_long_term(), session_id)
+        if not entries:
+            return []
+        q = _embed_texts([query], is_query=True)[0]
+        if matrix.shape[1] != q.size:
+            return []  # every stored vector came from a different embedding model
+        scores = matrix.astype(np.float32) @ q
+        k = min(top_k, len(entries))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [entries[i] for i in top]
     except Exception as e:
-        print(f"[ERROR] Failed to get relevant memory: {e}")
+        print(f"[ERROR] Failed to get relevant memory for session '{session_id}': {e}")
     return []
 
 
+def clear_long_term_memory():
+    """
+    Delete the long-term memory of every session.
+    """
+    try:
+        with _session_lock:
+            conn = _ensure_long_term()
+            conn.execute("DELETE FROM long_term")
+            conn.commit()
+            _long_term.clear()
+        print("[INFO] Long-term memory cleared.")
+    except Exception as e:
+        print(f"[ERROR] Failed to clear long-term memory: {e}")
+
 
 def clear_memory_file():
     """
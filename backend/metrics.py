@@ -0,0 +1,143 @@
+# metrics.py
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{n}="{v}"' for n, v in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - t0, **labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {n}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def render_latest():
+    """
+    All registered metrics in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===== Metrics shared across modules =====
+STAGE_SECONDS = Histogram("turboask_stage_seconds", "Time spent per request stage", ["stage"])
+REQUEST_SECONDS = Histogram("turboask_request_seconds", "End-to-end request latency", ["endpoint"])
+REQUESTS_TOTAL = Counter("turboask_requests_total", "Requests by endpoint and status code", ["endpoint", "status"])
+PROMPT_TOKENS = Counter("turboask_prompt_tokens_total", "Prompt tokens sent to the generation model")
+COMPLETION_TOKENS = Counter("turboask_completion_tokens_total", "Tokens generated by the model")
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "turboask_generation_tokens_per_second", "Generation throughput per request", ["backend"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+ADMISSION_QUEUE_DEPTH = Gauge("turboask_admission_queue_depth", "Requests waiting for an admission slot", ["gate"])
+ADMISSION_ACTIVE = Gauge("turboask_admission_active", "Requests holding an admission slot", ["gate"])
+ADMISSION_WAIT_SECONDS = Histogram("turboask_admission_wait_seconds", "Time spent queued before admission", ["gate"])
+ADMISSION_REJECTED_TOTAL = Counter("turboask_admission_rejected_total", "Requests shed by admission control",
+                                   ["gate", "reason"])
+
+
+def observe_stages(timings):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
@@ -0,0 +1,76 @@
+# prefix_cache.py
+import copy
+import threading
+from collections import OrderedDict
+import torch
+
+PREFIX_CACHE_ENTRIES = 16
+
+
+class PrefixCache:
+    """
+    Keeps the model's past key/values for fixed prompt prefixes (one per domain), so a
+    request only has to encode the variable part of its prompt before generating.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=PREFIX_CACHE_ENTRIES):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # prefix text -> (prefix ids, past key/values)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supported(model):
+        # decoder-only torch models; encoder-decoder and ONNX Runtime models re-encode every time
+        return isinstance(model, torch.nn.Module) and not getattr(model.config, "is_encoder_decoder", False)
+
+    def _encode(self, text):
+        return self.tokenizer(text, return_tensors="pt", add_special_tokens=False).input_ids.to(self.model.device)
+
+    def get(self, prefix_text):
+        with self._lock:
+            entry = self._entries.get(prefix_text)
+            if entry is not None:
+                self._entries.move_to_end(prefix_text)
+                self.hits += 1
+                return entry
+        ids = self._encode(prefix_text)
+        with torch.no_grad():
+            past = self.model(input_ids=ids, use_cache=True).past_key_values
+        with self._lock:
+            self.misses += 1
+            self._entries[prefix_text] = (ids, past)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return ids, past
+
+    def build_inputs(self, prefix_text, suffix_text):
+        """
+        generate() kwargs that start from the cached prefix state: only suffix tokens get encoded.
+        """
+        prefix_ids, past = self.get(prefix_text)
+        suffix_ids = self._encode(suffix_text)
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=-1)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            # generate() extends the cache in place, so every request gets its own copy
+            "past_key_values": copy.deepcopy(past),
+        }
+
+    def generate(self, prefix_text, suffix_text, **gen_kwargs):
+        """
+        Generate a completion for prefix_text + suffix_text. Returns only the new text.
+        """
+        inputs = self.build_inputs(prefix_text, suffix_text)
+        with torch.no_grad():
+            out = self.model.generate(**inputs, **gen_kwargs)
+        new_tokens = out[0, inputs["input_ids"].shape[-1]:]
+        return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,98 @@
+# prompt_budget.py
+from collections import OrderedDict
+import threading
+
+TOKEN_CACHE_SIZE = 4096
+
+
+class PromptBudget:
+    """
+    Fits question, retrieved chunks and memory snippets into the model window in one pass.
+    Token counts come from the generation model's own tokenizer and are cached per text,
+    so the same chunk or memory snippet is only tokenized once across requests.
+    """
+
+    def __init__(self, tokenizer, max_model_length, max_new_tokens=0, cache_size=TOKEN_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.max_model_length = max_model_length
+        self.max_new_tokens = max_new_tokens
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        if not text:
+            return 0
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self._cache.move_to_end(text)
+                return n
+        n = len(self.tokenizer.encode(text, add_special_tokens=False))
+        with self._lock:
+            self._cache[text] = n
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return n
+
+    def truncate(self, text, max_tokens):
+        if max_tokens <= 0:
+            return ""
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        return self.tokenizer.decode(ids[:max_tokens], skip_special_tokens=True)
+
+    def context_room(self, template_text, question):
+        """
+        Tokens left for retrieved context and history once template, question and generation are reserved.
+        """
+        return self.max_model_length - self.count(template_text) - self.count(question) - self.max_new_tokens
+
+    def fit(self, template_text, question, chunks, snippets, chunk_sep="\n---\n", snippet_sep="\n"):
+        """
+        Greedily fill the budget: template + question + max_new_tokens are reserved first,
+        then retrieved chunks in rank order (the last one may be cut), then memory snippets
+        newest first. Returns (kept_chunks, kept_snippets, usage) where usage is tokens per section.
+        """
+        usage = {
+            "template": self.count(template_text),
+            "question": self.count(question),
+            "reserved_generation": self.max_new_tokens,
+            "context": 0,
+            "history": 0,
+        }
+        remaining = self.context_room(template_text, question)
+
+        chunk_sep_cost = self.count(chunk_sep)
+        kept_chunks = []
+        for chunk in chunks:
+            cost = self.count(chunk) + (chunk_sep_cost if kept_chunks else 0)
+            if cost <= remaining:
+                kept_chunks.append(chunk)
+            else:
+                room = remaining - (chunk_sep_cost if kept_chunks else 0)
+                cut = self.truncate(chunk, room)
+                if cut:
+                    kept_chunks.append(cut)
+                    cost = room
+                else:
+                    cost = 0
+                remaining -= cost
+                usage["context"] += cost
+                break
+            remaining -= cost
+            usage["context"] += cost
+
+        snippet_sep_cost = self.count(snippet_sep)
+        kept_snippets = []
+        for snippet in reversed(snippets):
+            cost = self.count(snippet) + (snippet_sep_cost if kept_snippets else 0)
+            if cost > remaining:
+                break
+            kept_snippets.append(snippet)
+            remaining -= cost
+            usage["history"] += cost
+        kept_snippets.reverse()
+
+        usage["total"] = usage["template"] + usage["question"] + usage["context"] + usage["history"]
+        usage["budget"] = self.max_model_length
+        return kept_chunks, kept_snippets, usage
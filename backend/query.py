@@ -1,139 +1,470 @@
 import os
 import time
-import torch
+import hashlib
+from queue import Empty
+from threading import Event, Thread, RLock
 from dotenv import load_dotenv
-from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+from transformers import AutoTokenizer, pipeline, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 from langchain_community.llms import HuggingFacePipeline
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from get_vector_db import get_vector_db
-from memory_store import load_memory, save_memory, get_relevant_memory
-import tiktoken
+from get_vector_db import get_vector_db, _ensure_embedding
+from retrieval import domain_label, parse_domains, retrieve, retrieve_cross_domain
+from llm_backends import load_generation_model
+from metrics import PROMPT_TOKENS, COMPLETION_TOKENS, GENERATION_TOKENS_PER_SECOND, observe_stages
+from prompt_budget import PromptBudget
+from prefix_cache import PrefixCache
+from batching import GenerationScheduler, BatchedLLM, GEN_MAX_BATCH_SIZE
+from memory_store import add_long_term_memory, append_turn, get_recent_messages, get_relevant_memory, DEFAULT_SESSION
+from admission import check_deadline
+from answer_cache import lookup_answer, store_answer, ANSWER_CACHE, ANSWER_CACHE_SIMILARITY
+from context_compression import compress_chunks, COMPRESS_CONTEXT, COMPRESS_TARGET_TOKENS
 
 load_dotenv()
 
 HF_MODEL = os.getenv('HF_MODEL', 'sshleifer/tiny-gpt2')
 RECENT_TURNS = int(os.getenv("RECENT_TURNS", "2"))
 TOP_MEMORY_K = int(os.getenv("TOP_MEMORY_K", "3"))
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "256"))
+# Opt-in: answers that start from the cached preamble are generated one at a time and
+# skip the GenerationScheduler's batching, which wins under concurrent load
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "false").lower() == "true"
+STREAM_TOKEN_TIMEOUT = float(os.getenv("STREAM_TOKEN_TIMEOUT", "120"))  # max seconds to wait for the next streamed token
 
 _tokenizer = None
 _model = None
 _hf_pipe = None
 _max_model_length = None
+_llm = None
+_budget = None
+_backend_info = None
+_prefix_cache = None
+_prompts = None
+_template_texts = {}
+_prefix_texts = {}
+_load_lock = RLock()  # background warm-up and the first request may race to load the model
 
 def _ensure_pipeline():
-    global _tokenizer, _model, _hf_pipe, _max_model_length
-    if _hf_pipe is None:
+    global _tokenizer, _model, _hf_pipe, _max_model_length, _budget, _backend_info, _prefix_cache
+    if _hf_pipe is not None:
+        return _hf_pipe
+    with _load_lock:
+        if _hf_pipe is not None:
+            return _hf_pipe
         model_name = HF_MODEL
         _tokenizer = AutoTokenizer.from_pretrained(model_name)
 
-        if any(x in model_name.lower() for x in ["t5", "flan", "bart"]):
-            _model = AutoModelForSeq2SeqLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto",
-                low_cpu_mem_usage=True
-            )
-            gen = pipeline("text2text-generation", model=_model, tokenizer=_tokenizer, max_new_tokens=256)
+        seq2seq = any(x in model_name.lower() for x in ["t5", "flan", "bart"])
+        _model, _backend_info = load_generation_model(model_name, seq2seq)
+
+        if seq2seq:
+            gen = pipeline("text2text-generation", model=_model, tokenizer=_tokenizer, max_new_tokens=MAX_NEW_TOKENS)
+            reserved = 0  # encoder-decoder: generated tokens don't share the input window
         else:
-            _model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto",
-                low_cpu_mem_usage=True
-            )
-            gen = pipeline("text-generation", model=_model, tokenizer=_tokenizer, max_new_tokens=256,
+            if _tokenizer.pad_token is None:
+                _tokenizer.pad_token = _tokenizer.eos_token
+            _tokenizer.padding_side = "left"  # batched decoder-only generation needs left padding
+            gen = pipeline("text-generation", model=_model, tokenizer=_tokenizer, max_new_tokens=MAX_NEW_TOKENS,
                            pad_token_id=_tokenizer.eos_token_id)
+            reserved = MAX_NEW_TOKENS
 
         _max_model_length = getattr(_model.config, "max_position_embeddings", 1024)
+        _budget = PromptBudget(_tokenizer, _max_model_length, reserved)
+        if PREFIX_CACHE and PrefixCache.supported(_model):
+            _prefix_cache = PrefixCache(_model, _tokenizer)
         _hf_pipe = HuggingFacePipeline(pipeline=gen)
         print(f"[INFO] Model loaded: {model_name}")
     return _hf_pipe
 
-memory = load_memory()
+def _ensure_llm():
+    """
+    LLM used by the chains: the batching scheduler when GEN_MAX_BATCH_SIZE > 1,
+    otherwise the plain HuggingFacePipeline.
+    """
+    global _llm
+    if _llm is None:
+        with _load_lock:
+            if _llm is None:
+                hf_pipe = _ensure_pipeline()
+                if GEN_MAX_BATCH_SIZE > 1:
+                    _llm = BatchedLLM(scheduler=GenerationScheduler(hf_pipe.pipeline))
+                else:
+                    _llm = hf_pipe
+    return _llm
 
 def count_tokens(text):
-    try:
-        enc = tiktoken.encoding_for_model(HF_MODEL)
-    except Exception:
-        enc = tiktoken.get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    _ensure_pipeline()
+    return _budget.count(text)
 
 def get_prompts():
-    QUERY_PROMPT = PromptTemplate(
-        input_variables=["question"],
-        template="Generate 3 alternative phrasings of this question to improve search recall.\nReturn them as bullet points.\nOriginal: {question}"
-    )
-    template = (
-        "You are a concise and helpful assistant for the {domain} domain.\n"
-        "Use the Conversation History (for personalization & continuity) and the Retrieved Context (for factual grounding).\n"
-        "If context is insufficient, say so briefly.\n\n"
-        "Conversation History:\n{chat_history}\n\n"
-        "Retrieved Context:\n{context}\n\n"
-        "Question:\n{question}\n\n"
-        "Answer:"
-    )
-    prompt = ChatPromptTemplate.from_template(template)
-    return QUERY_PROMPT, prompt
+    global _prompts
+    if _prompts is None:
+        QUERY_PROMPT = PromptTemplate(
+            input_variables=["question"],
+            template="Generate 3 alternative phrasings of this question to improve search recall.\nReturn them as bullet points.\nOriginal: {question}"
+        )
+        template = (
+            "You are a concise and helpful assistant for the {domain} domain.\n"
+            "Use the Conversation History (for personalization & continuity) and the Retrieved Context (for factual grounding).\n"
+            "If context is insufficient, say so briefly.\n\n"
+            "Conversation History:\n{chat_history}\n\n"
+            "Retrieved Context:\n{context}\n\n"
+            "Question:\n{question}\n\n"
+            "Answer:"
+        )
+        prompt = ChatPromptTemplate.from_template(template)
+        _prompts = (QUERY_PROMPT, prompt)
+    return _prompts
 
-def query(user_input, domain="general", return_docs=False):
-    if not user_input:
-        return "(no input)", 0 if return_docs else "(no input)"
+def _prefix_text(domain):
+    """
+    The part of the answer prompt before {chat_history}; identical for every request in a domain.
+    """
+    text = _prefix_texts.get(domain)
+    if text is None:
+        _, prompt = get_prompts()
+        marker = "\x00HISTORY\x00"
+        text = prompt.format(context="", question="", chat_history=marker, domain=domain).split(marker)[0]
+        _prefix_texts[domain] = text
+    return text
+
+def _split_prompt(prompt_text, domain):
+    """
+    (prefix, suffix) of a formatted prompt when the prefix KV cache can serve it, else None.
+    """
+    if _prefix_cache is None:
+        return None
+    prefix = _prefix_text(domain)
+    if not prompt_text.startswith(prefix) or len(prompt_text) == len(prefix):
+        return None
+    return prefix, prompt_text[len(prefix):]
 
-    llm = _ensure_pipeline()
-    db = get_vector_db(domain)
-    QUERY_PROMPT, prompt = get_prompts()
+def _template_text(domain):
+    """
+    The answer prompt with every variable section empty, i.e. its fixed token cost for a domain.
+    """
+    text = _template_texts.get(domain)
+    if text is None:
+        _, prompt = get_prompts()
+        text = prompt.format(context="", question="", chat_history="", domain=domain)
+        _template_texts[domain] = text
+    return text
 
-    relevant_memories = get_relevant_memory(user_input, top_k=TOP_MEMORY_K)
-    recent_history = memory.load_memory_variables({}).get("chat_history", [])[-(RECENT_TURNS * 2):]
+def _memory_snippets(user_input, session_id, stats):
+    """
+    The session's relevant long-term memories and recent turns as prompt snippets.
+    Fills stats["timings"]["memory"].
+    """
+    t0 = time.time()
+    relevant_memories = get_relevant_memory(user_input, TOP_MEMORY_K, session_id)
+    recent_history = get_recent_messages(session_id, RECENT_TURNS * 2)
 
     memory_snippets = [f"User: {m.get('user','')}\nBot: {m.get('bot','')}" for m in relevant_memories]
     for turn in recent_history:
-        role = getattr(turn, "type", "User").capitalize()
-        content = getattr(turn, "content", "")
-        memory_snippets.append(f"{role}: {content}")
-    combined_memory_text = "\n".join(memory_snippets)
+        role = turn.get("role", "user").capitalize()
+        memory_snippets.append(f"{role}: {turn.get('content', '')}")
+    stats.setdefault("timings", {})["memory"] = time.time() - t0
+    return memory_snippets
 
-    retriever = MultiQueryRetriever.from_llm(db.as_retriever(search_kwargs={"k": 2}), llm, prompt=QUERY_PROMPT)
-    context_docs = retriever.get_relevant_documents(user_input)
 
-    if not context_docs:
-        context_docs = db.similarity_search(user_input, k=3)
+def _build_context(user_input, domain, llm, stats, memory_snippets, strategy=None):
+    """
+    Gather retrieved context for a question and trim it and `memory_snippets` to fit the
+    model window. A comma-separated `domain` searches all listed domains with one query
+    embedding. Fills stats["timings"], stats["tokens"], stats["retrieval"] and stats["compression"].
+    Returns (combined_memory_text, retrieved_context, context_docs).
+    """
+    timings = stats.setdefault("timings", {})
+    domains = parse_domains(domain)
+    QUERY_PROMPT, _ = get_prompts()
 
-    retrieved_context = "\n---\n".join([doc.page_content for doc in context_docs]) if context_docs else ""
-    total_text = combined_memory_text + "\n" + retrieved_context + "\n" + user_input
+    if len(domains) > 1:
+        context_docs, stats["retrieval"] = retrieve_cross_domain({d: get_vector_db(d) for d in domains}, user_input)
+    else:
+        context_docs, stats["retrieval"] = retrieve(get_vector_db(domains[0]), domains[0], user_input, llm=llm,
+                                                    strategy=strategy, query_prompt=QUERY_PROMPT)
+    timings["retrieval"] = stats["retrieval"]["latency"]
+    for stage in ("rephrase", "lexical_search", "query_embedding", "vector_search"):
+        if stage in stats["retrieval"]:
+            timings[stage] = stats["retrieval"][stage]
 
-    while count_tokens(total_text) > _max_model_length and memory_snippets:
-        memory_snippets.pop(0)
-        combined_memory_text = "\n".join(memory_snippets)
-        total_text = combined_memory_text + "\n" + retrieved_context + "\n" + user_input
+    chunks = [doc.page_content for doc in context_docs]
+    if COMPRESS_CONTEXT and chunks:
+        # keep the question-relevant sentences instead of cutting the tail of the last chunk;
+        # the target is the window's room minus the history (which may claim at most half of it)
+        t0 = time.time()
+        room = _budget.context_room(_template_text(domain), user_input)
+        history = sum(_budget.count(s) + 1 for s in memory_snippets)
+        room = max(room - history, room // 2)
+        if COMPRESS_TARGET_TOKENS > 0:
+            room = min(room, COMPRESS_TARGET_TOKENS)
+        chunks, stats["compression"] = compress_chunks(user_input, chunks, _ensure_embedding(), _budget.count,
+                                                       room, sep_cost=_budget.count("\n---\n"))
+        timings["compression"] = time.time() - t0
+
+    t0 = time.time()
+    kept_chunks, kept_snippets, stats["tokens"] = _budget.fit(_template_text(domain), user_input, chunks, memory_snippets)
+    retrieved_context = "\n---\n".join(kept_chunks)
+    combined_memory_text = "\n".join(kept_snippets)
+    timings["budget"] = time.time() - t0
+
+    return combined_memory_text, retrieved_context, context_docs
+
+
+class _StopWhen(StoppingCriteria):
+    """
+    Ends generate() once the request deadline passes or `cancelled` is set (client went away).
+    """
+
+    def __init__(self, deadline=None, cancelled=None):
+        self.deadline = deadline
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.cancelled is not None and self.cancelled.is_set():
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+
+def _cached_answer(user_input, domain, strategy, stats, history=""):
+    """
+    Look the question up in the answer cache and record the outcome in stats["cache"].
+    `history` is the conversation history/memory text the prompt keeps: answers that drew
+    on one are only reused with the same one.
+    Returns (payload or None, cache key); pass the key to store_answer() after generating.
+    """
+    t0 = time.time()
+    domains = parse_domains(domain)
+    scope = f"{domain}|{strategy or ''}"
+    if history:
+        scope += "|" + hashlib.sha256(history.encode("utf-8")).hexdigest()
+    # chunk counts per domain: any ingest or delete, in any process, changes the version
+    version = tuple(get_vector_db(d)._collection.count() for d in domains)
+    vector = None
+    if ANSWER_CACHE_SIMILARITY <= 1.0:
+        # the embedding service caches this vector, so retrieval doesn't encode the question again
+        vector = get_vector_db(domains[0]).embeddings.embed_query(user_input)
+    hit = lookup_answer(scope, user_input, version, vector)
+    stats.setdefault("timings", {})["answer_cache"] = time.time() - t0
+    key = (scope, domains, version, vector)
+    if hit is None:
+        stats["cache"] = {"hit": False}
+        return None, key
+    payload, kind, similarity = hit
+    stats["cache"] = {"hit": True, "kind": kind, "similarity": similarity}
+    return payload, key
+
+
+def _remember(user_input, response, session_id=DEFAULT_SESSION):
+    append_turn(session_id, user_input, response)
+    add_long_term_memory(user_input, response, session_id)
 
-    while count_tokens(total_text) > _max_model_length and retrieved_context:
-        words = retrieved_context.split()
-        if len(words) <= 50:
-            retrieved_context = ""
-        else:
-            retrieved_context = " ".join(words[50:])
-        total_text = combined_memory_text + "\n" + retrieved_context + "\n" + user_input
-
-    chain = (
-        {
-            "context": lambda _: retrieved_context,
-            "question": RunnablePassthrough(),
-            "chat_history": lambda _: combined_memory_text,
-            "domain": lambda _: domain,
-        }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    response = str(chain.invoke(user_input))
 
-    memory.save_context({"input": user_input}, {"output": response})
-    save_memory(memory)
+def _record_generation(stats, prompt_text, completion, seconds):
+    """
+    Add prompt/completion token counts and tokens/s to stats and export all stage timings.
+    """
+    prompt_tokens = _budget.count(prompt_text)
+    completion_tokens = _budget.count(completion)
+    stats["generation"] = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": completion_tokens / seconds if seconds > 0 else 0.0,
+    }
+    PROMPT_TOKENS.inc(prompt_tokens)
+    COMPLETION_TOKENS.inc(completion_tokens)
+    backend = (_backend_info or {}).get("backend", "unknown")
+    stats["generation"]["backend"] = backend
+    if completion_tokens:
+        GENERATION_TOKENS_PER_SECOND.observe(stats["generation"]["tokens_per_second"], backend=backend)
+    observe_stages(stats["timings"])
+
+
+def query(user_input, domain="general", return_docs=False, session_id=DEFAULT_SESSION, strategy=None, stats=None,
+          use_memory=True, use_cache=True, deadline=None):
+    """
+    Answer a question. `strategy` picks the retrieval strategy (dense / hybrid / multi_query);
+    `domain` may also list several domains (or "all") for a cross-domain dense search.
+    Pass a dict as `stats` to receive per-stage timings, token usage and retrieval info.
+    With use_memory=False no conversation memory is read or written (used by evaluation).
+    With use_cache=True a cached answer to the same (or a near-identical) question is returned
+    without generation; stats["cache"] tells whether that happened. Without session memory
+    the lookup also skips retrieval; otherwise it runs once the prompt budget has picked the
+    history to keep, and only matches answers given with that same history.
+    `deadline` (epoch seconds) stops the work once the caller has given up: DeadlineExceeded
+    between stages, TimeoutError while waiting for a generation batch.
+    """
+    if not user_input:
+        return "(no input)", 0 if return_docs else "(no input)"
+
+    domain = domain_label(parse_domains(domain))
+    stats = {} if stats is None else stats
+    use_cache = use_cache and ANSWER_CACHE
+    memory_snippets = _memory_snippets(user_input, session_id, stats) if use_memory else []
+    cached, cache_key = None, None
+    if use_cache and not memory_snippets:
+        cached, cache_key = _cached_answer(user_input, domain, strategy, stats)
+    if cached is None:
+        llm = _ensure_llm()
+        _, prompt = get_prompts()
+        combined_memory_text, retrieved_context, context_docs = _build_context(
+            user_input, domain, llm, stats, memory_snippets, strategy)
+        if use_cache and memory_snippets:
+            cached, cache_key = _cached_answer(user_input, domain, strategy, stats, combined_memory_text)
+    if cached is not None:
+        if use_memory:
+            _remember(user_input, cached["answer"], session_id)
+        observe_stages(stats["timings"])
+        return (cached["answer"], cached["retrieved_docs"]) if return_docs else cached["answer"]
+
+    prompt_text = prompt.format(context=retrieved_context, question=user_input,
+                                chat_history=combined_memory_text, domain=domain)
+    split = _split_prompt(prompt_text, domain)
+    check_deadline(deadline, "generation")
+    t0 = time.time()
+    if split is not None:
+        # start from the cached KV state of the domain's fixed preamble
+        response = _prefix_cache.generate(*split, max_new_tokens=MAX_NEW_TOKENS,
+                                          pad_token_id=_tokenizer.pad_token_id or _tokenizer.eos_token_id,
+                                          stopping_criteria=StoppingCriteriaList([_StopWhen(deadline)]))
+    else:
+        if deadline is not None and isinstance(llm, BatchedLLM):
+            llm = llm.bind(deadline=deadline)
+        chain = (
+            {
+                "context": lambda _: retrieved_context,
+                "question": RunnablePassthrough(),
+                "chat_history": lambda _: combined_memory_text,
+                "domain": lambda _: domain,
+            }
+            | prompt
+            | llm
+            | StrOutputParser()
+        )
+        response = str(chain.invoke(user_input))
+    stats["timings"]["generation"] = time.time() - t0
+    # an answer cut short by the deadline is neither returned, remembered nor cached
+    check_deadline(deadline, "response")
+
+    if use_memory:
+        t0 = time.time()
+        _remember(user_input, response, session_id)
+        stats["timings"]["memory_persist"] = time.time() - t0
+
+    # text-generation pipelines echo the prompt before the completion
+    completion = response[len(prompt_text):] if response.startswith(prompt_text) else response
+    _record_generation(stats, prompt_text, completion, stats["timings"]["generation"])
+    if cache_key is not None:
+        scope, domains, version, vector = cache_key
+        store_answer(scope, domains, user_input, version, {"answer": response, "retrieved_docs": len(context_docs)}, vector)
 
     if return_docs:
         return response, len(context_docs)
     return response
+
+
+def query_stream(user_input, domain="general", session_id=DEFAULT_SESSION, strategy=None, use_cache=True,
+                 deadline=None):
+    """
+    Generator version of query(): yields ("token", text) pieces as the model produces them,
+    then a final ("done", info) with the retrieved doc count, per-stage timings, token usage,
+    retrieval and answer cache info. A cached answer arrives as a single token.
+    Generation stops at `deadline` (raising DeadlineExceeded instead of "done") or as soon
+    as the consumer closes the generator.
+    """
+    if not user_input:
+        yield "token", "(no input)"
+        yield "done", {"retrieved_docs": 0, "timings": {}, "tokens": {}}
+        return
+
+    domain = domain_label(parse_domains(domain))
+    stats = {}
+    use_cache = use_cache and ANSWER_CACHE
+    memory_snippets = _memory_snippets(user_input, session_id, stats)
+    cached, cache_key = None, None
+    # as in query(): with session memory the lookup waits for the history the budget keeps
+    if use_cache and not memory_snippets:
+        cached, cache_key = _cached_answer(user_input, domain, strategy, stats)
+    if cached is None:
+        llm = _ensure_llm()
+        _, prompt = get_prompts()
+        combined_memory_text, retrieved_context, context_docs = _build_context(
+            user_input, domain, llm, stats, memory_snippets, strategy)
+        if use_cache and memory_snippets:
+            cached, cache_key = _cached_answer(user_input, domain, strategy, stats, combined_memory_text)
+    if cached is not None:
+        yield "token", cached["answer"]
+        _remember(user_input, cached["answer"], session_id)
+        observe_stages(stats["timings"])
+        stats["retrieved_docs"] = cached["retrieved_docs"]
+        yield "done", stats
+        return
+    timings = stats["timings"]
+
+    prompt_text = prompt.format(
+        context=retrieved_context,
+        question=user_input,
+        chat_history=combined_memory_text,
+        domain=domain,
+    )
+    split = _split_prompt(prompt_text, domain)
+    if split is not None:
+        inputs = _prefix_cache.build_inputs(*split)
+    else:
+        inputs = _tokenizer(prompt_text, return_tensors="pt").to(_model.device)
+    streamer = TextIteratorStreamer(_tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                    timeout=STREAM_TOKEN_TIMEOUT)
+    cancelled = Event()
+    gen_kwargs = dict(**inputs, streamer=streamer, max_new_tokens=MAX_NEW_TOKENS,
+                      pad_token_id=_tokenizer.pad_token_id or _tokenizer.eos_token_id,
+                      stopping_criteria=StoppingCriteriaList([_StopWhen(deadline, cancelled)]))
+    check_deadline(deadline, "generation")
+
+    t0 = time.time()
+    first_token_at = None
+    errors = []
+
+    def _generate():
+        try:
+            _model.generate(**gen_kwargs)
+        except Exception as e:
+            # without the end marker the consumer below would wait for tokens that never come
+            errors.append(e)
+            streamer.end()
+
+    worker = Thread(target=_generate, daemon=True)
+    worker.start()
+    pieces = []
+    try:
+        for piece in streamer:
+            if not piece:
+                continue
+            if first_token_at is None:
+                first_token_at = time.time()
+            pieces.append(piece)
+            yield "token", piece
+    except Empty:
+        raise TimeoutError(f"No token generated within {STREAM_TOKEN_TIMEOUT:.0f}s") from None
+    finally:
+        # GeneratorExit when the client disconnects: stop generating for nobody
+        cancelled.set()
+    worker.join(STREAM_TOKEN_TIMEOUT)
+    if errors:
+        raise errors[0]
+    # as in query(): an answer cut short by the deadline is neither remembered nor cached,
+    # and the consumer gets an error instead of "done"
+    check_deadline(deadline, "response")
+    timings["first_token"] = (first_token_at or time.time()) - t0
+    timings["generation"] = time.time() - t0
+
+    response = "".join(pieces)
+    t0 = time.time()
+    _remember(user_input, response, session_id)
+    timings["memory_persist"] = time.time() - t0
+    _record_generation(stats, prompt_text, response, timings["generation"])
+    stats["retrieved_docs"] = len(context_docs)
+    if cache_key is not None:
+        scope, domains, version, vector = cache_key
+        store_answer(scope, domains, user_input, version, {"answer": response, "retrieved_docs": len(context_docs)}, vector)
+    yield "done", stats
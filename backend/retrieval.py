@@ -0,0 +1,268 @@
+# retrieval.py
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema import Document
+from langchain.retrievers.multi_query import MultiQueryRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+STRATEGIES = ("dense", "hybrid", "multi_query")
+DEFAULT_STRATEGY = os.getenv("RETRIEVAL_STRATEGY", "multi_query")
+# Per-domain overrides, e.g. "law=hybrid,general=dense"
+DOMAIN_STRATEGIES = dict(
+    item.split("=", 1) for item in os.getenv("RETRIEVAL_STRATEGIES", "").split(",") if "=" in item
+)
+DENSE_K = int(os.getenv("DENSE_K", "3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = 60
+# Cross-domain mode: one query embedding fanned out to several domain collections
+SEARCH_DOMAINS = [d.strip() for d in os.getenv(
+    "SEARCH_DOMAINS", "law,healthcare,finance,education,multimodal,general").split(",") if d.strip()]
+CROSS_DOMAIN_K = int(os.getenv("CROSS_DOMAIN_K", "4"))
+CROSS_DOMAIN_QUOTA = int(os.getenv("CROSS_DOMAIN_QUOTA", "2"))  # max chunks taken from one domain
+CROSS_DOMAIN_WORKERS = int(os.getenv("CROSS_DOMAIN_WORKERS", "6"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    Minimal in-memory BM25 index over a domain's chunks.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = []
+        self.term_freqs = []
+        self.doc_lens = []
+        self.postings = defaultdict(list)  # term -> [doc index]
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, docs):
+        for doc in docs:
+            tf = Counter(_tokenize(doc.page_content))
+            idx = len(self.docs)
+            self.docs.append(doc)
+            self.term_freqs.append(tf)
+            self.doc_lens.append(sum(tf.values()))
+            self.total_len += self.doc_lens[-1]
+            for term in tf:
+                self.postings[term].append(idx)
+
+    def search(self, query, k):
+        n = len(self.docs)
+        if n == 0:
+            return []
+        avgdl = self.total_len / n or 1.0
+        scores = defaultdict(float)
+        for term in set(_tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for i in posting:
+                f = self.term_freqs[i][term]
+                denom = f + self.k1 * (1 - self.b + self.b * self.doc_lens[i] / avgdl)
+                scores[i] += idf * f * (self.k1 + 1) / denom
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [self.docs[i] for i, _ in ranked]
+
+
+_lexical = {}
+_lexical_lock = threading.Lock()
+
+
+def _collection_count(db):
+    try:
+        return db._collection.count()
+    except Exception:
+        return -1
+
+
+def get_lexical_index(domain, db):
+    """
+    Lexical index for a domain, rebuilt from the Chroma collection whenever its size drifts
+    (e.g. another process ingested documents).
+    """
+    with _lexical_lock:
+        index = _lexical.get(domain)
+        count = _collection_count(db)
+        if index is None or (count >= 0 and count != len(index)):
+            data = db.get(include=["documents", "metadatas"])
+            index = LexicalIndex()
+            index.add([
+                Document(page_content=text or "", metadata=meta or {})
+                for text, meta in zip(data.get("documents", []), data.get("metadatas", []))
+            ])
+            _lexical[domain] = index
+        return index
+
+
+def add_to_lexical_index(domain, docs):
+    """
+    Keep an already-built lexical index in sync after new chunks are written to Chroma.
+    """
+    with _lexical_lock:
+        index = _lexical.get(domain)
+        if index is not None:
+            index.add(docs)
+
+
+def drop_lexical_index(domain):
+    with _lexical_lock:
+        _lexical.pop(domain, None)
+
+
+def _doc_key(doc):
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings, k=DENSE_K):
+    """
+    Merge several ranked doc lists: score(d) = sum over lists of 1 / (RRF_K + rank).
+    """
+    scores = defaultdict(float)
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] += 1.0 / (RRF_K + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+
+def parse_domains(domain):
+    """
+    Normalize a domain argument to a list: a single name, a comma-separated string or a list.
+    "all" expands to SEARCH_DOMAINS.
+    """
+    items = domain.split(",") if isinstance(domain, str) else list(domain or [])
+    domains = []
+    for item in items:
+        item = str(item).strip()
+        for d in (SEARCH_DOMAINS if item == "all" else [item]):
+            if d and d not in domains:
+                domains.append(d)
+    return domains or ["general"]
+
+
+def domain_label(domains):
+    return ", ".join(domains)
+
+
+def merge_by_score(candidates, k=CROSS_DOMAIN_K, quota=CROSS_DOMAIN_QUOTA):
+    """
+    Pick the k best (domain, doc, score) candidates by normalized score, taking at most
+    `quota` chunks from any one domain and skipping duplicate chunks.
+    """
+    taken = Counter()
+    seen = set()
+    merged = []
+    for domain, doc, score in sorted(candidates, key=lambda c: c[2], reverse=True):
+        key = _doc_key(doc)
+        if taken[domain] >= quota or key in seen:
+            continue
+        seen.add(key)
+        taken[domain] += 1
+        merged.append((domain, doc, score))
+        if len(merged) >= k:
+            break
+    return merged
+
+
+_fanout_pool = None
+_fanout_lock = threading.Lock()
+
+
+def _ensure_fanout_pool():
+    global _fanout_pool
+    with _fanout_lock:
+        if _fanout_pool is None:
+            _fanout_pool = ThreadPoolExecutor(max_workers=max(1, CROSS_DOMAIN_WORKERS), thread_name_prefix="domain-search")
+        return _fanout_pool
+
+
+def retrieve_cross_domain(dbs, question, k=CROSS_DOMAIN_K, quota=CROSS_DOMAIN_QUOTA):
+    """
+    Dense search over several domain collections at once. The question is embedded once,
+    each collection is searched concurrently with that vector, and hits are merged by their
+    store's normalized relevance score. Every returned doc carries metadata["domain"].
+    `dbs` maps domain -> vector store. Returns (docs, info) like retrieve().
+    """
+    t0 = time.time()
+    vector = next(iter(dbs.values())).embeddings.embed_query(question)
+    info = {"strategy": "cross_domain", "domains": list(dbs), "query_embedding": time.time() - t0}
+
+    def search(item):
+        domain, db = item
+        relevance = db._select_relevance_score_fn()
+        hits = db.similarity_search_by_vector_with_relevance_scores(vector, k=quota)
+        return [(domain, doc, relevance(distance)) for doc, distance in hits]
+
+    candidates = []
+    for hits in _ensure_fanout_pool().map(search, dbs.items()):
+        candidates.extend(hits)
+    merged = merge_by_score(candidates, k=k, quota=quota)
+
+    docs = []
+    for domain, doc, score in merged:
+        doc.metadata["domain"] = domain
+        docs.append(doc)
+    info["chunks"] = [
+        {"domain": domain, "source": doc.metadata.get("source"), "page": doc.metadata.get("page"), "score": score}
+        for domain, doc, score in merged
+    ]
+    info["latency"] = time.time() - t0
+    info["vector_search"] = info["latency"] - info["query_embedding"]
+    return docs, info
+
+
+def resolve_strategy(domain, requested=None):
+    strategy = requested or DOMAIN_STRATEGIES.get(domain) or DEFAULT_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown retrieval strategy '{strategy}', expected one of {STRATEGIES}")
+    return strategy
+
+
+def retrieve(db, domain, question, llm=None, strategy=None, query_prompt=None):
+    """
+    Run one retrieval strategy. Returns (docs, info) where info holds the strategy name, its
+    total latency and the split into rephrase / lexical_search / vector_search time.
+    """
+    strategy = resolve_strategy(domain, strategy)
+    t0 = time.time()
+    info = {"strategy": strategy}
+    if strategy == "dense":
+        docs = db.similarity_search(question, k=DENSE_K)
+    elif strategy == "hybrid":
+        dense = db.similarity_search(question, k=HYBRID_CANDIDATES)
+        t1 = time.time()
+        lexical = get_lexical_index(domain, db).search(question, HYBRID_CANDIDATES)
+        info["lexical_search"] = time.time() - t1
+        docs = reciprocal_rank_fusion([dense, lexical], k=DENSE_K)
+    else:
+        retriever = MultiQueryRetriever.from_llm(db.as_retriever(search_kwargs={"k": 2}), llm, prompt=query_prompt)
+        run_manager = CallbackManagerForRetrieverRun.get_noop_manager()
+        queries = retriever.generate_queries(question, run_manager)
+        info["rephrase"] = time.time() - t0
+        # one batched embedding call; the per-query searches below then hit the embedding cache
+        db.embeddings.embed_documents([q for q in queries if q])
+        docs = retriever.unique_union(retriever.retrieve_documents(queries, run_manager))
+        if not docs:
+            docs = db.similarity_search(question, k=DENSE_K)
+    info["latency"] = time.time() - t0
+    info["vector_search"] = info["latency"] - info.get("rephrase", 0.0) - info.get("lexical_search", 0.0)
+    return docs, info
@@ -1,11 +1,51 @@
 # seed_data.py
 import os
-from embed import embed
+import json
+import hashlib
+from embed import embed_many, delete_chunks, referenced_chunks
+from get_vector_db import CHROMA_PATH
 
 # Folder containing your local PDFs
 PDF_FOLDER = os.path.join(os.path.dirname(__file__), "seed_docs")  # e.g., backend/pdfs
 
-def seed_local_pdfs():
+
+def _manifest_path(domain):
+    # Lives next to the vector DB so resetting ./chroma also resets what counts as ingested
+    return os.path.join(CHROMA_PATH, f"seed_manifest-{domain}.json")
+
+
+def load_manifest(domain="general"):
+    try:
+        with open(_manifest_path(domain), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[!] Ignoring unreadable seed manifest: {e}")
+        return {}
+
+
+def save_manifest(manifest, domain="general"):
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    tmp = _manifest_path(domain) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_path(domain))
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def seed_local_pdfs(domain="general"):
+    """
+    Incrementally sync PDF_FOLDER into the vector DB: only new or changed PDFs are parsed
+    and embedded, and chunks of PDFs that were removed or changed are deleted.
+    """
     if not os.path.exists(PDF_FOLDER):
         print(f"[!] PDF folder not found: {PDF_FOLDER}")
         return
@@ -16,10 +56,50 @@ def seed_local_pdfs():
         print("[!] No PDF files found in seed folder.")
         return
 
+    manifest = load_manifest(domain)
+    current = {}
+    to_embed = []
     for pdf in pdf_files:
         pdf_path = os.path.join(PDF_FOLDER, pdf)
-        print(f"[+] Embedding {pdf} ...")
-        embed(pdf_path, domain="general")
+        mtime = os.path.getmtime(pdf_path)
+        entry = manifest.get(pdf)
+        if entry and entry.get("mtime") == mtime:
+            current[pdf] = entry
+            continue
+        digest = _file_sha256(pdf_path)
+        if entry and entry.get("sha256") == digest:
+            current[pdf] = dict(entry, mtime=mtime)
+            continue
+        current[pdf] = {"mtime": mtime, "sha256": digest, "ids": []}
+        to_embed.append(pdf_path)
+
+    # Chunks of removed or changed files, unless another file or an upload still has the same content
+    stale = set()
+    for pdf, entry in manifest.items():
+        if pdf not in current or current[pdf].get("sha256") != entry.get("sha256"):
+            stale.update(entry.get("ids", []))
+
+    if to_embed:
+        print(f"[+] Embedding {len(to_embed)} new/changed PDFs ...")
+        embedded = embed_many(to_embed, domain=domain)
+        for pdf_path in to_embed:
+            pdf = os.path.basename(pdf_path)
+            if pdf_path in embedded:
+                current[pdf]["ids"] = embedded[pdf_path]
+            else:
+                current.pop(pdf)  # failed: retry on the next run
+
+    still_used = {cid for entry in current.values() for cid in entry.get("ids", [])}
+    # uploaded documents share chunks by content too
+    still_used |= referenced_chunks(domain, stale - still_used)
+    removed = sorted(stale - still_used)
+    if removed:
+        delete_chunks(removed, domain=domain)
+        print(f"[-] Deleted {len(removed)} chunks from removed/changed PDFs")
+
+    save_manifest(current, domain)
+    print(f"[*] Seed sync done: {len(to_embed)} embedded, {len(pdf_files) - len(to_embed)} unchanged.")
+
 
 if __name__ == "__main__":
     seed_local_pdfs()
@@ -0,0 +1,245 @@
+# serve.py
+"""
+Pre-fork production server.
+
+The master process imports the app with blocking warm-up, so the LLM, the embedding
+model and the vector DB are loaded once, then forks SERVE_WORKERS workers that share
+those weights copy-on-write and accept connections on the master's listening socket.
+Each worker runs werkzeug's threaded server with its own torch thread budget.
+
+Signals to the master:
+    SIGTERM / SIGINT : graceful shutdown (workers finish in-flight requests)
+    SIGHUP           : recycle every worker one by one
+
+Usage: python backend/serve.py
+"""
+import gc
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import threading
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("PORT", "8080"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))
+SERVE_BACKLOG = int(os.getenv("SERVE_BACKLOG", "128"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))  # torch intra-op threads per worker; 0 = cores / workers
+WORKER_CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "false").lower() == "true"
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0"))  # recycle after N requests; 0 = never
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0"))
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _can_preload():
+    # ONNX Runtime sessions own thread pools created at load time; those threads don't
+    # exist in a forked child, so with ONNX backends every worker loads its own models.
+    # Read the settings from the environment rather than importing the backend modules:
+    # those read INTRA_OP_THREADS at import, which preload() and the workers set afterwards.
+    gen_backend = os.getenv("GEN_BACKEND", "torch").lower()
+    embed_backend = os.getenv("EMBED_BACKEND", "torch").lower()
+    return gen_backend != "onnx" and embed_backend != "onnx"
+
+
+class _RequestTracker:
+    """
+    WSGI middleware counting in-flight and served requests; calls `on_limit` once the
+    worker has served `max_requests` (0 = no limit).
+    """
+
+    def __init__(self, app, max_requests, on_limit):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.active = 0
+        self.served = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+        with self._lock:
+            self.active += 1
+            self.served += 1
+            limit_hit = self.max_requests and self.served == self.max_requests
+        if limit_hit:
+            self.on_limit()
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            self._done()
+            raise
+        # streamed (SSE) responses stay in flight until the iterable is closed
+        return ClosingIterator(body, self._done)
+
+    def _done(self):
+        with self._lock:
+            self.active -= 1
+
+
+def _pin_worker(index, threads):
+    if WORKER_CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+        cpus = _available_cpus()
+        start = (index * threads) % len(cpus)
+        mine = [cpus[(start + i) % len(cpus)] for i in range(min(threads, len(cpus)))]
+        os.sched_setaffinity(0, mine)
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _run_worker(sock, index, threads, preloaded):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl+C
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    if not preloaded:
+        os.environ["INTRA_OP_THREADS"] = str(threads)
+    _pin_worker(index, threads)
+
+    import app as app_module
+    from werkzeug.serving import make_server
+    app_module.init_app()  # no-op when the master already initialized it before forking
+
+    if preloaded and app_module.readiness.is_ready("whisper"):
+        # Whisper was dropped at fork (see media_processing._after_fork); reload it off the request path
+        threading.Thread(target=app_module._media()._ensure_whisper, name="whisper-reload", daemon=True).start()
+
+    stopping = threading.Event()
+    server = None
+
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() blocks until serve_forever() returns, so it can't run on the serving thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    max_requests = WORKER_MAX_REQUESTS
+    if max_requests and WORKER_MAX_REQUESTS_JITTER:
+        max_requests += random.randint(0, WORKER_MAX_REQUESTS_JITTER)
+    tracker = _RequestTracker(app_module.app, max_requests, stop)
+    server = make_server(SERVE_HOST, SERVE_PORT, tracker, threaded=True, fd=sock.fileno())
+    signal.signal(signal.SIGTERM, stop)
+    print(f"[INFO] Worker {index} (pid {os.getpid()}) serving with {threads} torch threads")
+    server.serve_forever()
+
+    deadline = time.time() + WORKER_GRACEFUL_TIMEOUT
+    while tracker.active > 0 and time.time() < deadline:
+        time.sleep(0.1)
+    if app_module.ingest_queue is not None:
+        # uploads this worker accepted: finish them in the time left, fail and clean up the rest
+        app_module.ingest_queue.shutdown(max(0.0, deadline - time.time()))
+    reason = "request limit" if max_requests and tracker.served >= max_requests else "shutdown"
+    print(f"[INFO] Worker {index} (pid {os.getpid()}) exiting after {tracker.served} requests ({reason})")
+    sys.stdout.flush()
+    os._exit(0)
+
+
+class Master:
+    def __init__(self, workers=SERVE_WORKERS):
+        self.n_workers = max(1, workers)
+        cpus = len(_available_cpus())
+        self.threads = WORKER_THREADS or max(1, cpus // self.n_workers)
+        self.preloaded = False
+        self.sock = None
+        self.workers = {}  # pid -> (index, started)
+        self.stopping = False
+        self._recycle = []
+
+    def preload(self):
+        if not _can_preload():
+            print("[!] ONNX backend selected; every worker loads its own models.")
+            return
+        os.environ["WARMUP_MODE"] = "blocking"
+        # Keep the master single-threaded in torch: an OpenMP pool started before fork()
+        # can deadlock the children. Workers set their own thread count after forking.
+        os.environ["INTRA_OP_THREADS"] = "1"
+        import app
+        app.init_app()  # loads every model
+        # move everything loaded so far out of the GC's reach, so collections in the
+        # workers don't touch (and un-share) the master's pages
+        gc.collect()
+        gc.freeze()
+        self.preloaded = True
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET6 if ":" in SERVE_HOST else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((SERVE_HOST, SERVE_PORT))
+        sock.listen(SERVE_BACKLOG)
+        self.sock = sock
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(self.sock, index, self.threads, self.preloaded)
+            except BaseException as e:
+                print(f"[ERROR] Worker {index} crashed: {e}")
+            finally:
+                sys.stdout.flush()
+                os._exit(1)
+        self.workers[pid] = (index, time.time())
+
+    def _signal_all(self, sig):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _on_stop(self, *_):
+        if self.stopping:
+            return
+        self.stopping = True
+        print("[INFO] Shutting down workers...")
+        self._signal_all(signal.SIGTERM)
+        timer = threading.Timer(WORKER_GRACEFUL_TIMEOUT + 5, self._signal_all, args=(signal.SIGKILL,))
+        timer.daemon = True
+        timer.start()
+
+    def _on_hup(self, *_):
+        # recycle one worker at a time; the next one goes once its replacement is up
+        self._recycle = list(self.workers)
+        self._recycle_next()
+
+    def _recycle_next(self):
+        while self._recycle:
+            pid = self._recycle.pop(0)
+            if pid in self.workers:
+                os.kill(pid, signal.SIGTERM)
+                return
+
+    def run(self):
+        self.preload()
+        self.bind()
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        print(f"[INFO] Master {os.getpid()} on {SERVE_HOST}:{SERVE_PORT}: "
+              f"{self.n_workers} workers x {self.threads} threads (preloaded={self.preloaded})")
+        for i in range(self.n_workers):
+            self.spawn(i)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index, started = self.workers.pop(pid, (None, 0))
+            if index is None or self.stopping:
+                continue
+            if status != 0 and time.time() - started < 5:
+                time.sleep(1)  # crash loop guard
+            self.spawn(index)
+            self._recycle_next()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    Master().run()
@@ -0,0 +1,181 @@
+import multiprocessing
+import numpy as np
+import pytest
+
+import local_index
+from local_index import LocalVectorStore
+
+DIM = 16
+
+
+class _NoEmbedding:
+    def embed_documents(self, texts):
+        raise AssertionError("tests add vectors directly")
+
+    def embed_query(self, text):
+        raise AssertionError("tests search by vector")
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _store(tmp_path, name="test"):
+    return LocalVectorStore(name, _NoEmbedding(), root=str(tmp_path))
+
+
+def _ids(prefix, n):
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def test_exact_search_finds_nearest_row(tmp_path):
+    store = _store(tmp_path)
+    vecs = _vectors(100)
+    store.add_vectors(vecs, [f"doc {i}" for i in range(100)], ids=_ids("v", 100))
+
+    hits = store._search(vecs[42], 3)
+    assert hits[0][0] == "v42"
+    assert hits[0][1] == "doc 42"
+    assert hits[0][3] == pytest.approx(0.0, abs=1e-2)
+    assert [h[3] for h in hits] == sorted(h[3] for h in hits)
+
+
+def test_duplicate_ids_are_skipped(tmp_path):
+    store = _store(tmp_path)
+    vecs = _vectors(10)
+    store.add_vectors(vecs, ["x"] * 10, ids=_ids("v", 10))
+    store.add_vectors(vecs[:5], ["x"] * 5, ids=_ids("v", 5))
+    assert store.count() == 10
+    assert store._state["rows"] == 10
+
+
+def test_delete_tombstones_row_and_frees_id(tmp_path):
+    store = _store(tmp_path)
+    vecs = _vectors(20)
+    store.add_vectors(vecs, [f"doc {i}" for i in range(20)], ids=_ids("v", 20))
+
+    store.delete(ids=["v3"])
+    assert store.count() == 19
+    assert "v3" not in [h[0] for h in store._search(vecs[3], 20)]
+    assert store.get(ids=["v3"])["ids"] == []
+
+    # the id was renamed on delete, so the same content can be added again as a new row
+    store.add_vectors(vecs[3:4], ["doc 3 again"], ids=["v3"])
+    assert store.count() == 20
+    assert store._state["rows"] == 21
+    hit = store._search(vecs[3], 1)[0]
+    assert hit[:2] == ("v3", "doc 3 again")
+
+
+def test_ivf_index_is_built_and_searched(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_ANN_THRESHOLD", 200)
+    monkeypatch.setattr(local_index, "LOCAL_IVF_NPROBE", 4)
+    store = _store(tmp_path)
+    vecs = _vectors(300)
+    store.add_vectors(vecs[:250], ["x"] * 250, ids=_ids("v", 250))
+    assert store._centroids is not None
+    assert store._state["ivf_rows"] == 250
+
+    # rows added after the build are assigned to their nearest centroid on insert
+    store.add_vectors(vecs[250:], ["x"] * 50, ids=_ids("w", 50))
+    assert store._state["ivf_rows"] == 250
+    expected = np.argmax(local_index._normalize(vecs[250:]) @ store._centroids.T, axis=1)
+    assert np.array_equal(store._assign[250:300], expected)
+
+    for i in (0, 137, 249):
+        assert store._search(vecs[i], 1)[0][0] == f"v{i}"
+    assert store._search(vecs[260], 1)[0][0] == "w10"
+
+
+def test_ivf_inverted_lists_follow_inserts_and_rebuilds(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_ANN_THRESHOLD", 200)
+    monkeypatch.setattr(local_index, "LOCAL_IVF_NPROBE", 2)
+    store = _store(tmp_path)
+    reader = _store(tmp_path)
+    vecs = _vectors(600, seed=3)
+
+    def assert_lists_match_assignment(s):
+        n = s._state["rows"]
+        assign = np.asarray(s._assign[:n])
+        assert s._listed == n
+        assert sum(len(rows) for rows in s._lists) == n
+        for c, rows in enumerate(s._lists):
+            assert np.array_equal(rows, np.nonzero(assign == c)[0])
+
+    store.add_vectors(vecs[:250], ["x"] * 250, ids=_ids("v", 250))
+    assert_lists_match_assignment(store)
+
+    # inserts extend the lists, in the writer and in a reader of the same files
+    store.add_vectors(vecs[250:400], ["x"] * 150, ids=_ids("w", 150))
+    assert store._state["ivf_rows"] == 250
+    reader.count()
+    for s in (store, reader):
+        assert_lists_match_assignment(s)
+
+    # a rebuild replaces them
+    store.add_vectors(vecs[400:], ["x"] * 200, ids=_ids("u", 200))
+    assert store._state["ivf_rows"] == 600
+    reader.count()
+    for s in (store, reader):
+        assert_lists_match_assignment(s)
+
+    # candidates come from the probed lists only
+    q = local_index._normalize(vecs[7])
+    rows, _ = store._candidate_scores(q)
+    probe = np.argsort(-(store._centroids @ q))[:2]
+    assert np.array_equal(rows, np.nonzero(np.isin(store._assign[:600], probe))[0])
+    assert store._search(vecs[7], 1)[0][0] == "v7"
+
+
+def test_reopened_store_sees_existing_rows(tmp_path):
+    store = _store(tmp_path)
+    vecs = _vectors(10)
+    store.add_vectors(vecs, ["x"] * 10, ids=_ids("v", 10))
+    store.delete(ids=["v0"])
+
+    reopened = _store(tmp_path)
+    assert reopened.count() == 9
+    assert reopened._search(vecs[5], 1)[0][0] == "v5"
+
+
+def test_delete_does_not_roll_back_other_writer(tmp_path):
+    a = _store(tmp_path)
+    b = _store(tmp_path)
+    vecs = _vectors(20)
+    a.add_vectors(vecs[:10], ["x"] * 10, ids=_ids("a", 10))
+    b.add_vectors(vecs[10:15], ["x"] * 5, ids=_ids("b", 5))  # b has not looked at state since a wrote
+    b.delete(ids=["a0"])                                     # must not write back a stale row count
+    a.add_vectors(vecs[15:], ["x"] * 5, ids=_ids("c", 5))
+
+    fresh = _store(tmp_path)
+    assert fresh._state["rows"] == 20
+    assert fresh.count() == 19
+    for i, cid in ((5, "a5"), (12, "b2"), (17, "c2")):
+        assert fresh._search(vecs[i], 1)[0][0] == cid
+
+
+def _add_from_process(root, prefix, seed):
+    store = LocalVectorStore("test", _NoEmbedding(), root=root)
+    vecs = _vectors(100, seed)
+    for start in range(0, 100, 10):
+        store.add_vectors(vecs[start:start + 10], ["x"] * 10, ids=[f"{prefix}{i}" for i in range(start, start + 10)])
+
+
+@pytest.mark.skipif(local_index.fcntl is None, reason="needs flock")
+def test_concurrent_writers_in_separate_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_add_from_process, args=(str(tmp_path), p, seed))
+             for p, seed in (("p", 1), ("q", 2))]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+        assert p.exitcode == 0
+
+    store = _store(tmp_path)
+    assert store._state["rows"] == 200
+    assert store.count() == 200
+    for prefix, seed in (("p", 1), ("q", 2)):
+        vecs = _vectors(100, seed)
+        for i in (0, 55, 99):
+            assert store._search(vecs[i], 1)[0][0] == f"{prefix}{i}"
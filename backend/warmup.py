@@ -0,0 +1,69 @@
+# warmup.py
+import time
+import threading
+from collections import OrderedDict
+
+
+class Readiness:
+    """
+    Tracks load state of startup components (pending -> loading -> ready | failed)
+    and how long each took, for the readiness probe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components = OrderedDict()
+
+    def register(self, name, required=True):
+        with self._lock:
+            self._components.setdefault(name, {
+                "state": "pending", "required": required, "load_time": None, "error": None,
+            })
+
+    def run(self, name, fn):
+        self.register(name)
+        with self._lock:
+            self._components[name]["state"] = "loading"
+        t0 = time.time()
+        try:
+            fn()
+        except Exception as e:
+            with self._lock:
+                self._components[name].update(state="failed", error=str(e), load_time=time.time() - t0)
+            print(f"[!] Warm-up of {name} failed: {e}")
+            return False
+        with self._lock:
+            self._components[name].update(state="ready", load_time=time.time() - t0)
+        print(f"[INFO] {name} ready in {time.time() - t0:.2f}s")
+        return True
+
+    def is_ready(self, name=None):
+        with self._lock:
+            if name is not None:
+                return self._components.get(name, {}).get("state") == "ready"
+            return all(c["state"] == "ready" for c in self._components.values() if c["required"])
+
+    def report(self):
+        with self._lock:
+            return {name: dict(c) for name, c in self._components.items()}
+
+
+def start_background(readiness, steps):
+    """
+    Run each chain of (name, fn) steps on its own daemon thread; steps in one chain run in order.
+    Returns the started threads.
+    """
+    threads = []
+    for chain in steps:
+        for name, _ in chain:
+            readiness.register(name)
+
+        def _run(chain=chain):
+            for name, fn in chain:
+                if not readiness.run(name, fn):
+                    break
+
+        t = threading.Thread(target=_run, name=f"warmup-{chain[0][0]}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
@@ -1,4 +1,6 @@
 import os
+import json
+import uuid
 import requests
 import streamlit as st
 from dotenv import load_dotenv
@@ -21,37 +23,87 @@ st.markdown("""
 st.markdown("<h1 style='text-align:center; color:#FFDD00;'>⚡ TurboAsk</h1>"
             "<p style='text-align:center; color:#888;'>Multimodal Conversational RAG (Text • Image • Audio • Video)</p>", unsafe_allow_html=True)
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # --- Sidebar ---
 with st.sidebar:
     st.markdown("## ⚙️ Settings")
-    domain = st.selectbox("Choose Domain", ["law","healthcare","finance","education","multimodal","general"], index=5)
+    domains = st.multiselect("Choose Domains", ["law","healthcare","finance","education","multimodal","general"],
+                             default=["general"],
+                             help="Pick several to search them together in one query")
+    domain = ",".join(domains) or "general"
+    retrieval = st.selectbox("Retrieval Strategy", ["multi_query","hybrid","dense"], index=0,
+                             help="dense/hybrid skip the extra LLM pass used to rephrase the question")
+    stream_answers = st.checkbox("Stream answers", value=True)
 
     st.markdown("---")
-    if st.button("🧹 Clear All Memory (File + Session)"):
+    if st.button("🧹 Clear Session Memory"):
         try:
-            r = requests.post(f"{API_URL}/clear_memory")
+            r = requests.post(f"{API_URL}/clear_memory", json={"session_id": st.session_state.session_id})
             st.success(r.json().get("message", "Memory cleared"))
         except Exception as e:
             st.error(f"Failed to clear memory: {e}")
 
     if st.button("🔄 Forget Current Session"):
         try:
-            r = requests.post(f"{API_URL}/forget_session")
+            r = requests.post(f"{API_URL}/forget_session", json={"session_id": st.session_state.session_id})
             st.success(r.json().get("message", "Session forgotten"))
         except Exception as e:
             st.error(f"Failed to forget session: {e}")
 
+def stream_query(data, files_payload, placeholder):
+    """
+    POST to /query/stream and render tokens into `placeholder` as they arrive.
+    Returns (answer, latency, retrieved_docs, retrieval) once the final `done` event is received.
+    """
+    if files_payload:
+        resp = requests.post(f"{API_URL}/query/stream", data=data, files=files_payload, stream=True, timeout=600)
+    else:
+        resp = requests.post(f"{API_URL}/query/stream", json=data, stream=True, timeout=600)
+    if not resp.ok:
+        return f"Error {resp.status_code}: {resp.text}", None, None, None
+
+    answer, latency, retrieved_docs, retrieval_info = "", None, None, None
+    event = None
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            payload = json.loads(line[len("data:"):].strip())
+            if event == "token":
+                answer += payload.get("text", "")
+                placeholder.markdown(f"<div class='chat-container'><div class='assistant-msg'>{answer}</div></div>", unsafe_allow_html=True)
+            elif event == "done":
+                latency = payload.get("latency")
+                retrieved_docs = payload.get("retrieved_docs")
+                retrieval_info = payload.get("retrieval")
+            elif event == "error":
+                answer = f"Request failed: {payload.get('error')}"
+    placeholder.empty()
+    return answer or "(no answer)", latency, retrieved_docs, retrieval_info
+
+def chunk_domains(retrieval_info):
+    """
+    Comma-separated domains the answer's chunks came from (cross-domain queries only).
+    """
+    chunks = (retrieval_info or {}).get("chunks") or []
+    return ", ".join(dict.fromkeys(c["domain"] for c in chunks))
+
 # --- Chat state ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-def render_message(role, content, latency=None, retrieved_docs=None):
+def render_message(role, content, latency=None, retrieved_docs=None, sources=None):
     bubble_class = "user-msg" if role=="user" else "assistant-msg"
-    latency_text = f"<div class='latency-text'>⏱ {latency:.2f}s | 📄 Retrieved Docs: {retrieved_docs}</div>" if latency else ""
+    sources_text = f" | 🗂 {sources}" if sources else ""
+    latency_text = f"<div class='latency-text'>⏱ {latency:.2f}s | 📄 Retrieved Docs: {retrieved_docs}{sources_text}</div>" if latency else ""
     st.markdown(f"<div class='chat-container'><div class='{bubble_class}'>{content}{latency_text}</div></div>", unsafe_allow_html=True)
 
 for msg in st.session_state.messages:
-    render_message(msg["role"], msg["content"], msg.get("latency"), msg.get("retrieved_docs"))
+    render_message(msg["role"], msg["content"], msg.get("latency"), msg.get("retrieved_docs"), msg.get("sources"))
 
 # --- User input ---
 user_input = st.chat_input("💬 Ask me anything...")
@@ -69,28 +121,41 @@ if user_input or uploads:
         st.session_state.messages.append({"role":"user","content":user_input})
         render_message("user", user_input)
 
-    with st.spinner("🤖 TurboAsk is thinking..."):
-        files_payload = [("files", (f.name, f.getvalue())) for f in uploads] if uploads else None
-        data = {"query": user_input or "", "domain": domain}
+    files_payload = [("files", (f.name, f.getvalue())) for f in uploads] if uploads else None
+    data = {"query": user_input or "", "domain": domain, "session_id": st.session_state.session_id, "retrieval": retrieval}
+    if stream_answers:
         try:
-            if uploads:
-                resp = requests.post(f"{API_URL}/query", data=data, files=files_payload, timeout=600)
-            else:
-                resp = requests.post(f"{API_URL}/query", json=data, timeout=600)
-
-            if resp.ok:
-                res_json = resp.json()
-                answer = res_json.get("answer", "(no answer)")
-                latency = res_json.get("latency", None)
-                retrieved_docs = res_json.get("retrieved_docs", None)
-            else:
-                answer = f"Error {resp.status_code}: {resp.text}"
-                latency = None
-                retrieved_docs = None
+            answer, latency, retrieved_docs, retrieval_info = stream_query(data, files_payload, st.empty())
         except Exception as e:
             answer = f"Request failed: {e}"
             latency = None
             retrieved_docs = None
+            retrieval_info = None
+    else:
+        with st.spinner("🤖 TurboAsk is thinking..."):
+            try:
+                if uploads:
+                    resp = requests.post(f"{API_URL}/query", data=data, files=files_payload, timeout=600)
+                else:
+                    resp = requests.post(f"{API_URL}/query", json=data, timeout=600)
+
+                if resp.ok:
+                    res_json = resp.json()
+                    answer = res_json.get("answer", "(no answer)")
+                    latency = res_json.get("latency", None)
+                    retrieved_docs = res_json.get("retrieved_docs", None)
+                    retrieval_info = res_json.get("retrieval")
+                else:
+                    answer = f"Error {resp.status_code}: {resp.text}"
+                    latency = None
+                    retrieved_docs = None
+                    retrieval_info = None
+            except Exception as e:
+                answer = f"Request failed: {e}"
+                latency = None
+                retrieved_docs = None
+                retrieval_info = None
 
-    st.session_state.messages.append({"role":"assistant","content":answer,"latency":latency,"retrieved_docs":retrieved_docs})
-    render_message("assistant", answer, latency, retrieved_docs)
+    sources = chunk_domains(retrieval_info)
+    st.session_state.messages.append({"role":"assistant","content":answer,"latency":latency,"retrieved_docs":retrieved_docs,"sources":sources})
+    render_message("assistant", answer, latency, retrieved_docs, sources)